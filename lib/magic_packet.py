@@ -0,0 +1,156 @@
+"""magic_packet.py: Wake-on-LAN magic packet sender"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import time
+import socket
+import typing
+import threading
+import collections
+
+BROADCAST_ADDRESS = ("255.255.255.255", 9)
+
+_MAC_SEPARATORS = str.maketrans("", "", ":-. ")
+_HEX_DIGITS = frozenset("0123456789abcdef")
+
+
+def normalize_mac(mac: str) -> str:
+    """
+    Return MAC address as 12 lowercase hex digits.
+
+    Accepts ``00:11:22:33:44:55``, ``00-11-22-33-44-55``, ``0011.2233.4455``
+    and bare ``001122334455``. Raises ``ValueError`` for anything else.
+    """
+    if not isinstance(mac, str):
+        raise ValueError(f"Incorrect MAC address format: {mac!r}")
+
+    digits = mac.translate(_MAC_SEPARATORS).lower()
+    if len(digits) != 12 or not _HEX_DIGITS.issuperset(digits):
+        raise ValueError(f"Incorrect MAC address format: {mac!r}")
+
+    return digits
+
+
+def format_mac(mac: typing.Union[str, int]) -> str:
+    """
+    Return MAC address in the canonical ``AA-BB-CC-DD-EE-FF`` form.
+
+    Accepts everything ``normalize_mac()`` does, plus the integer form used
+    for storage.
+    """
+    if isinstance(mac, int) and not isinstance(mac, bool):
+        if not 0 <= mac < 1 << 48:
+            raise ValueError(f"Incorrect MAC address format: {mac!r}")
+        digits = f"{mac:012X}"
+    else:
+        digits = normalize_mac(mac).upper()
+    return "-".join(digits[i:i + 2] for i in range(0, 12, 2))
+
+
+def mac_to_int(mac: str) -> int:
+    """MAC address as a 48-bit integer, the compact form kept in the database."""
+    return int(normalize_mac(mac), 16)
+
+
+def build_packet(mac: str) -> bytes:
+    """6 bytes of 0xFF followed by the MAC repeated 16 times (102 bytes)."""
+    return b"\xff" * 6 + bytes.fromhex(normalize_mac(mac)) * 16
+
+
+class MagicPacketSender:
+    """
+    Sends magic packets through one long-lived broadcast socket.
+
+    Packets are cached per normalized MAC with LRU eviction, so waking a
+    known device is a dictionary lookup plus a single ``sendto``.
+    """
+
+    def __init__(self, address: typing.Tuple[str, int] = BROADCAST_ADDRESS, cache_size: int = 4096):
+        self.address = address
+        self.cache_size = cache_size
+        self._packets: "collections.OrderedDict[str, bytes]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._socket: typing.Optional[socket.socket] = None
+
+    def packet(self, mac: str) -> bytes:
+        key = normalize_mac(mac)
+        with self._lock:
+            packet = self._packets.get(key)
+            if packet is not None:
+                self._packets.move_to_end(key)
+                return packet
+
+        packet = build_packet(key)
+        with self._lock:
+            self._packets[key] = packet
+            self._packets.move_to_end(key)
+            while len(self._packets) > self.cache_size:
+                self._packets.popitem(last=False)
+        return packet
+
+    def precompute(self, mac: str) -> None:
+        self.packet(mac)
+
+    def forget(self, mac: str) -> None:
+        with self._lock:
+            self._packets.pop(normalize_mac(mac), None)
+
+    def send(self, mac: str) -> None:
+        self._sendto(self.packet(mac))
+
+    def send_many(self, macs: typing.Iterable[str], interval: float = 0.0) -> typing.List[dict]:
+        """Send packets for every MAC, building all of them before the first send."""
+        results = []
+        packets = []
+        for mac in macs:
+            try:
+                packets.append((mac, self.packet(mac)))
+            except ValueError as e:
+                results.append({"mac": mac, "status": False, "error": str(e)})
+
+        for index, (mac, packet) in enumerate(packets):
+            if interval and index:
+                time.sleep(interval)
+            try:
+                self._sendto(packet)
+                results.append({"mac": mac, "status": True})
+            except OSError as e:
+                results.append({"mac": mac, "status": False, "error": str(e)})
+
+        return results
+
+    def close(self) -> None:
+        with self._lock:
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+
+    def _sendto(self, packet: bytes) -> None:
+        sock = self._get_socket()
+        try:
+            sock.sendto(packet, self.address)
+        except OSError:
+            # Interface could go down and up again, retry once on a fresh socket
+            self._reset_socket(sock)
+            self._get_socket().sendto(packet, self.address)
+
+    def _get_socket(self) -> socket.socket:
+        sock = self._socket
+        if sock is not None:
+            return sock
+
+        with self._lock:
+            if self._socket is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                self._socket = sock
+            return self._socket
+
+    def _reset_socket(self, sock: socket.socket) -> None:
+        with self._lock:
+            if self._socket is sock:
+                self._socket = None
+        sock.close()
@@ -5,37 +5,48 @@ __email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
 __copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
 __license__ = "GPL"
 
+import json
 import flask
 import flask.json
 import flask.blueprints
-import json
-import os
 import typing
-from wakeonlan import send_magic_packet
-import sqlite3
-import pathlib
-import requests
 import lib.connectivity
-
-def _resolve_db_path() -> pathlib.Path:
-    explicit_path = os.environ.get("MP_DB_PATH")
-    if explicit_path:
-        return pathlib.Path(explicit_path).expanduser()
-
-    data_dir = os.environ.get("MP_DATA_DIR")
-    if data_dir:
-        return pathlib.Path(data_dir).expanduser() / "devices.db"
-
-    return pathlib.Path(__file__).resolve().parent.parent / "data" / "devices.db"
-
-
-_DB_PATH = _resolve_db_path()
+import lib.magic_packet
+import server.serverlib.apikey
+import server.serverlib.children
+import server.serverlib.database
+import server.serverlib.endpoint
+import server.serverlib.etag
+import server.serverlib.health
+import server.serverlib.inventory
+import server.serverlib.registry
+import server.serverlib.settings
+
+_settings = server.serverlib.settings.get_settings()
+_database = server.serverlib.database.get_database()
+_api_keys = server.serverlib.apikey.get_api_key_store()
+_devices = server.serverlib.registry.get_device_registry()
+
+_magic_packets = lib.magic_packet.MagicPacketSender(cache_size=_settings.magic_packet_cache)
+_children = server.serverlib.children.get_child_client()
+_health = server.serverlib.health.get_health_tracker()
+
+_WOL_MAX_INTERVAL = 1.0
+
+_LIST_FIELDS = ("id", "ip", "mac", "config")
+_LIST_DEFAULT_FIELDS = ("ip", "mac", "config")
+_LIST_MAX_LIMIT = 1000
+
+_BULK_ACTIONS = {
+    "shutdown": "/control/shutdown",
+    "reboot": "/control/reboot",
+    "sleep": "/control/sleep",
+}
 
 control = flask.blueprints.Blueprint("control", __name__)
-_API_KEY_SETTING = "api_key"
 
 def _is_server_mode() -> bool:
-    return _DB_PATH.exists()
+    return _database.exists()
 
 def _generic_handler(connectivity_function):
     timeout = 0
@@ -56,61 +67,8 @@ def _generic_handler(connectivity_function):
 def _get_connectivity() -> lib.connectivity.Connectivity:
     return flask.current_app.connectivity
 
-def _get_setting(key: str) -> typing.Optional[str]:
-    if not _DB_PATH.exists():
-        return None
-
-    connection = _init_database()
-    cursor = connection.cursor()
-    cursor.execute("SELECT value FROM settings WHERE key = ?", (key,))
-    row = cursor.fetchone()
-    return row[0] if row else None
-
-def _set_setting(key: str, value: str) -> None:
-    connection = _init_database()
-    with connection:
-        connection.execute(
-            """
-            INSERT OR REPLACE INTO settings (key, value)
-            VALUES (?, ?)
-            """,
-            (key, value)
-        )
-
-def _init_database():
-    _DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    connection = sqlite3.connect(_DB_PATH)
-    with connection:
-        connection.execute(
-            """
-            CREATE TABLE IF NOT EXISTS devices (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                ip TEXT NOT NULL,
-                mac TEXT NOT NULL,
-                config TEXT
-            )
-            """
-        )
-        connection.execute(
-            """
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-            """
-        )
-    return connection
-
 def _validate_api_key():
-    api_key = flask.request.headers.get("Authorization")
-    if not api_key:
-        return False
-
-    stored_api_key = _get_setting(_API_KEY_SETTING)
-    if not stored_api_key or api_key != stored_api_key:
-        return False
-
-    return True
+    return _api_keys.verify(flask.request.headers.get("Authorization"))
 
 @control.route("/control/shutdown", methods=["POST"])
 def shutdown():
@@ -159,7 +117,9 @@ def setup():
         ), 400
     
     # Initialize database for storing server settings
-    _init_database()
+    _database.initialize()
+    _api_keys.invalidate()
+    _devices.invalidate()
 
     if flask.request.is_json:
         api_key = flask.request.json.get("api_key")
@@ -170,11 +130,11 @@ def setup():
             api_key = secrets.token_hex(16)
 
         if api_key:
-            _set_setting(_API_KEY_SETTING, api_key)
+            _api_keys.set(api_key)
 
     response = flask.json.jsonify(
         status=True,
-        api_key=_get_setting(_API_KEY_SETTING),
+        api_key=_api_keys.get(),
         message="Server setup completed successfully. Please store the API key securely and restart service or device."
     )
     return response
@@ -203,23 +163,39 @@ def configure_device():
     data = flask.request.json
     ip = data.get("ip")
     mac = data.get("mac")
-    config = data.get("config", {})
+    config = data.get("config") or {}
 
-    if not ip or not mac:
+    if not ip or not isinstance(ip, str) or not mac:
         return flask.json.jsonify(
             status=False,
             message="Missing required fields: ip and mac."
         ), 400
 
-    connection = _init_database()
-    with connection:
-        connection.execute(
-            """
-            INSERT INTO devices (ip, mac, config)
-            VALUES (?, ?, ?)
-            """,
-            (ip, mac, json.dumps(config))
-        )
+    if not isinstance(config, dict):
+        return flask.json.jsonify(
+            status=False,
+            message="Invalid field: config must be an object."
+        ), 400
+
+    # Validates the MAC and keeps its packet ready for the wake routes
+    try:
+        _magic_packets.precompute(mac)
+    except ValueError as e:
+        return flask.json.jsonify(
+            status=False,
+            message=str(e)
+        ), 400
+
+    # Port, scheme and base path the server uses to reach this device
+    try:
+        server.serverlib.endpoint.from_config(ip, config)
+    except ValueError as e:
+        return flask.json.jsonify(
+            status=False,
+            message=str(e)
+        ), 400
+
+    _devices.upsert(ip, mac, config)
 
     return flask.json.jsonify(
         status=True,
@@ -241,36 +217,122 @@ def list_devices():
             message="Method allowed only in server mode."
         ), 400
 
-    api_key = flask.request.headers.get("Authorization")
-    
-    if not api_key:
+    args = flask.request.args
+    fields = [field for field in args.get("fields", "").split(",") if field] or _LIST_DEFAULT_FIELDS
+    if not set(fields).issubset(_LIST_FIELDS):
         return flask.json.jsonify(
             status=False,
-            message="Missing API key in Authorization header."
-        ), 401
-    
-    stored_api_key = _get_setting(_API_KEY_SETTING)
-    if not stored_api_key or api_key != stored_api_key:
+            message=f"Invalid field: fields must be a subset of {','.join(_LIST_FIELDS)}."
+        ), 400
+
+    try:
+        after = int(args.get("after", 0))
+        limit = int(args["limit"]) if "limit" in args else None
+    except ValueError:
+        return flask.json.jsonify(
+            status=False,
+            message="Invalid field: after and limit must be integers."
+        ), 400
+
+    # Generation first: a write in between only makes the tag look older
+    etag = server.serverlib.etag.make("devices", server.serverlib.etag.PROCESS_EPOCH, _devices.generation)
+    if server.serverlib.etag.matches(etag):
+        return server.serverlib.etag.not_modified(etag)
+
+    if limit is None:
+        page = _devices.page(after)
+        next_after = None
+    else:
+        # One extra row tells whether there is a next page
+        limit = min(max(limit, 1), _LIST_MAX_LIMIT)
+        page = _devices.page(after, limit + 1)
+        next_after = page[limit - 1].id if len(page) > limit else None
+        page = page[:limit]
+
+    if args.get("format") == "ndjson":
+        lines = (json.dumps(_project(device, fields)) + "\n" for device in page)
+        return server.serverlib.etag.tag(flask.Response(lines, mimetype="application/x-ndjson"), etag)
+
+    response = {"status": True, "devices": [_project(device, fields) for device in page]}
+    if limit is not None:
+        response["next"] = next_after
+    return server.serverlib.etag.tag(flask.json.jsonify(response), etag)
+
+def _project(device: server.serverlib.registry.Device, fields: typing.Iterable[str]) -> dict:
+    return {field: getattr(device, field) for field in fields}
+
+@control.route("/control/device/import", methods=["POST"])
+def import_devices():
+
+    if not _validate_api_key():
         return flask.json.jsonify(
             status=False,
             message="Invalid API key."
         ), 403
-    
-    connection = _init_database()
-    cursor = connection.cursor()
-    cursor.execute("SELECT ip, mac, config FROM devices")
-    devices = [
-        {
-            "ip": row[0],
-            "mac": row[1],
-            "config": json.loads(row[2]) if row[2] else {}
-        }
-        for row in cursor.fetchall()
-    ]
-
-    return flask.json.jsonify(  
+
+    if not _is_server_mode():
+        return flask.json.jsonify(
+            status=False,
+            message="Method allowed only in server mode."
+        ), 400
+
+    fmt = server.serverlib.inventory.format_for_mimetype(flask.request.mimetype)
+    if fmt is None:
+        return flask.json.jsonify(
+            status=False,
+            message="Invalid request format. JSON, NDJSON or CSV expected."
+        ), 400
+
+    # Nothing is stored unless every row is valid
+    try:
+        records = server.serverlib.inventory.read(flask.request.stream, fmt)
+    except server.serverlib.inventory.InventoryError as e:
+        return flask.json.jsonify(
+            status=False,
+            message="Invalid devices, nothing was imported.",
+            errors=e.errors
+        ), 400
+    except UnicodeDecodeError:
+        return flask.json.jsonify(
+            status=False,
+            message="Invalid request encoding. UTF-8 expected."
+        ), 400
+
+    imported = _devices.upsert_many(records)
+
+    return flask.json.jsonify(
         status=True,
-        devices=devices
+        imported=imported,
+        message="Devices imported successfully."
+    )
+
+@control.route("/control/device/export", methods=["GET"])
+def export_devices():
+
+    if not _validate_api_key():
+        return flask.json.jsonify(
+            status=False,
+            message="Invalid API key."
+        ), 403
+
+    if not _is_server_mode():
+        return flask.json.jsonify(
+            status=False,
+            message="Method allowed only in server mode."
+        ), 400
+
+    fmt = flask.request.args.get("format", server.serverlib.inventory.FORMAT_JSON)
+    if fmt not in server.serverlib.inventory.FORMATS:
+        return flask.json.jsonify(
+            status=False,
+            message="Invalid format. Use json, ndjson or csv."
+        ), 400
+
+    # Written row by row from a snapshot of the registry, never as one payload
+    return flask.Response(
+        server.serverlib.inventory.write(_devices.all(), fmt),
+        mimetype=server.serverlib.inventory.MIMETYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename=devices.{fmt}"}
     )
 
 @control.route("/control/device/wake", methods=["POST"])
@@ -304,19 +366,119 @@ def wake_device():
                 message="Missing required field: mac."
             ), 400
         
-        send_magic_packet(mac)  
+        _magic_packets.send(mac)
+        _mark_woken([mac])
 
         return flask.json.jsonify(
             status=True,
-            message=f"Wake-on-LAN packet sent to {mac}."
+            message=f"Wake-on-LAN packet sent to {lib.magic_packet.format_mac(mac)}."
         )
-    
+
+    except ValueError as e:
+        return flask.json.jsonify(
+            status=False,
+            message=str(e)
+        ), 400
+
     except Exception as e:
         return flask.json.jsonify(
             status=False,
             message=f"Error sending Wake-on-LAN packet: {str(e)}"
         ), 500
 
+@control.route("/control/device/wake/batch", methods=["POST"])
+def wake_devices():
+
+    if not _validate_api_key():
+        return flask.json.jsonify(
+            status=False,
+            message="Invalid API key."
+        ), 403
+
+    if not _is_server_mode():
+        return flask.json.jsonify(
+            status=False,
+            message="Method allowed only in server mode."
+        ), 400
+
+    if not flask.request.is_json:
+        return flask.json.jsonify(
+            status=False,
+            message="Invalid request format. JSON expected."
+        ), 400
+
+    data = flask.request.json
+    macs = data.get("macs") or []
+    ids = data.get("ids") or []
+    if not isinstance(macs, list) or not isinstance(ids, list) or not (macs or ids):
+        return flask.json.jsonify(
+            status=False,
+            message="Missing required field: macs or ids (list)."
+        ), 400
+
+    try:
+        interval = min(max(float(data.get("interval", 0)), 0.0), _WOL_MAX_INTERVAL)
+    except (TypeError, ValueError):
+        return flask.json.jsonify(
+            status=False,
+            message="Invalid field: interval must be a number of seconds."
+        ), 400
+
+    # Canonical MACs, or the error of an unknown id, in input order
+    entries = [_canonical_mac(str(mac)) for mac in macs]
+
+    if ids:
+        devices = _get_devices(ids)
+        for device_id in ids:
+            device = devices.get(device_id)
+            if device is None:
+                entries.append({"id": device_id, "status": False, "error": "Unknown device."})
+            else:
+                entries.append(device["mac"])
+
+    # Same device named twice, by MAC or id, should get one packet
+    targets = list(dict.fromkeys(entry for entry in entries if isinstance(entry, str)))
+    sent = {result["mac"]: result for result in _magic_packets.send_many(targets, interval)}
+    _mark_woken(mac for mac, result in sent.items() if result["status"])
+
+    results = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = sent.pop(entry, None)
+        if entry is not None:
+            results.append(entry)
+
+    return flask.json.jsonify(
+        status=all(result["status"] for result in results),
+        results=results
+    )
+
+def _canonical_mac(mac: str) -> str:
+    # Results echo the canonical form; malformed input is echoed as given with its error
+    try:
+        return lib.magic_packet.format_mac(mac)
+    except ValueError:
+        return mac
+
+def _get_devices(ids: list) -> typing.Dict[int, dict]:
+    devices = {}
+    for device_id in ids:
+        device = _devices.by_id(device_id) if isinstance(device_id, int) else None
+        if device is not None:
+            devices[device_id] = {"ip": device.address, "mac": device.mac}
+    return devices
+
+def _get_device_ips_by_mac(macs: typing.Iterable[str]) -> typing.List[str]:
+    return [device.address for mac in macs for device in _devices.by_mac(mac)]
+
+def _mark_woken(macs: typing.Iterable[str]) -> None:
+    # A woken device must be probed again right away, not after its backoff
+    for ip in _get_device_ips_by_mac(macs):
+        _health.reset(ip)
+
+def _get_all_device_ips() -> typing.List[str]:
+    return [device.address for device in _devices.all()]
+
 @control.route("/control/device/shutdown", methods=["POST"])
 def shutdown_device():
     try:
@@ -355,7 +517,13 @@ def shutdown_device():
             ), 400
         
         #POST request to device shutdown endpoint
-        result = requests.post(f"http://{ip}:{5154}/control/shutdown", timeout=5)
+        try:
+            result = _children.post(ip, "/control/shutdown")
+        except server.serverlib.children.AmbiguousAddress as e:
+            return flask.json.jsonify(
+                status=False,
+                message=str(e)
+            ), 409
 
         if result.status_code != 200:
             return flask.json.jsonify(
@@ -412,7 +580,13 @@ def reboot_device():
             ), 400
         
         #POST request to device reboot endpoint
-        result = requests.post(f"http://{ip}:{5154}/control/reboot", timeout=5)
+        try:
+            result = _children.post(ip, "/control/reboot")
+        except server.serverlib.children.AmbiguousAddress as e:
+            return flask.json.jsonify(
+                status=False,
+                message=str(e)
+            ), 409
 
         if result.status_code != 200:
             return flask.json.jsonify(
@@ -463,7 +637,13 @@ def sleep_device():
             ), 400
         
         #POST request to device sleep endpoint
-        result = requests.post(f"http://{ip}:{5154}/control/sleep", timeout=5)
+        try:
+            result = _children.post(ip, "/control/sleep")
+        except server.serverlib.children.AmbiguousAddress as e:
+            return flask.json.jsonify(
+                status=False,
+                message=str(e)
+            ), 409
 
         if result.status_code != 200:
             return flask.json.jsonify(
@@ -480,4 +660,63 @@ def sleep_device():
         return flask.json.jsonify(
             status=False,
             message=f"Error sending sleep command: {str(e)}"
-        ), 500
\ No newline at end of file
+        ), 500
+
+@control.route("/control/device/bulk/<action>", methods=["POST"])
+def bulk_device_action(action: str):
+
+    if not _validate_api_key():
+        return flask.json.jsonify(
+            status=False,
+            message="Invalid API key."
+        ), 403
+
+    if not _is_server_mode():
+        return flask.json.jsonify(
+            status=False,
+            message="Method allowed only in server mode."
+        ), 400
+
+    path = _BULK_ACTIONS.get(action)
+    if path is None:
+        return flask.json.jsonify(
+            status=False,
+            message=f"Unknown action: {action}. Expected one of: {', '.join(_BULK_ACTIONS)}."
+        ), 404
+
+    if not flask.request.is_json:
+        return flask.json.jsonify(
+            status=False,
+            message="Invalid request format. JSON expected."
+        ), 400
+
+    data = flask.request.json
+    ips = data.get("ips") or []
+    ids = data.get("ids") or []
+    results = []
+
+    if data.get("all") is True:
+        ips = _get_all_device_ips()
+    elif not isinstance(ips, list) or not isinstance(ids, list) or not (ips or ids):
+        return flask.json.jsonify(
+            status=False,
+            message="Missing required field: ips, ids (list) or all."
+        ), 400
+    elif ids:
+        ips = list(ips)
+        devices = _get_devices(ids)
+        for device_id in ids:
+            device = devices.get(device_id)
+            if device is None:
+                results.append({"id": device_id, "status": False, "error": "Unknown device."})
+            else:
+                ips.append(device["ip"])
+
+    # Same host listed twice should get the command once
+    ips = list(dict.fromkeys(str(ip) for ip in ips))
+    results.extend(_children.post_many(ips, path))
+
+    return flask.json.jsonify(
+        status=all(result["status"] for result in results),
+        results=results
+    )
@@ -5,123 +5,380 @@ __email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
 __copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
 __license__ = "GPL"
 
-import os
-import pathlib, sqlite3, threading
+import hmac
+import json
+import math
+import queue
+import sqlite3
+import threading
 import flask, flask.json, flask.blueprints
-import requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def _resolve_db_path() -> pathlib.Path:
-    explicit_path = os.environ.get("MP_DB_PATH")
-    if explicit_path:
-        return pathlib.Path(explicit_path).expanduser()
-
-    data_dir = os.environ.get("MP_DATA_DIR")
-    if data_dir:
-        return pathlib.Path(data_dir).expanduser() / "devices.db"
-
-    return pathlib.Path(__file__).resolve().parent.parent / "data" / "devices.db"
+import server.serverlib.apikey
+import server.serverlib.children
+import server.serverlib.database
+import server.serverlib.etag
+import server.serverlib.health
+import server.serverlib.heartbeat
+import server.serverlib.monitor
+import server.serverlib.neighbors
+import server.serverlib.probe
+import server.serverlib.registry
+import server.serverlib.settings
 
 info = flask.blueprints.Blueprint("info", __name__)
 
-_DB_PATH = _resolve_db_path()
+# Leída una sola vez al arrancar, común a los dos blueprints
+_settings = server.serverlib.settings.get_settings()
+_database = server.serverlib.database.get_database()
 
-# ---- Cache & lock (thread-safe) ----
-_cache_lock = threading.Lock()
-_children_ips_cache = []
-_children_count = 0
+# ---- Cache (thread-safe) ----
+_devices = server.serverlib.registry.get_device_registry()
 _is_server_cached = None  # opcional: cachear resultado
 
 def check_server_status_cached():
-    """Evita consultar sqlite_master en cada request."""
+    """
+    El fichero de la base marca el modo servidor. El esquema lo deja listo
+    la migración del arranque, así que aquí no se consulta sqlite.
+    """
     global _is_server_cached
-    if _is_server_cached is not None:
-        return _is_server_cached
-    try:
-        with sqlite3.connect(_DB_PATH) as conn:
-            cur = conn.execute(
-                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='devices' LIMIT 1;"
-            )
-            _is_server_cached = (cur.fetchone() is not None)
-    except sqlite3.Error:
-        _is_server_cached = False
+    if not _is_server_cached:
+        _is_server_cached = _database.exists()
     return _is_server_cached
 
-def _update_children_cache():
-    global _children_ips_cache, _children_count
-    try:
-        with sqlite3.connect(_DB_PATH) as conn:
-            cur = conn.execute("SELECT ip FROM devices;")
-            ips = [row[0] for row in cur.fetchall()]
-        with _cache_lock:
-            _children_ips_cache = ips
-            _children_count = len(ips)
-    except sqlite3.Error:
-        # no rompas la ruta por fallas de cache
-        pass
-
 def _get_children_ips():
-    """Lee COUNT y refresca cache solo si cambió."""
-    global _children_count
+    """Del registro en memoria, sin tocar sqlite salvo que otra escritura lo invalide."""
     try:
-        with sqlite3.connect(_DB_PATH) as conn:
-            cur = conn.execute("SELECT COUNT(*) FROM devices;")
-            current_count = cur.fetchone()[0]
+        # La direccion incluye el puerto cuando el dispositivo no usa el de siempre
+        return [device.address for device in _devices.all()]
     except sqlite3.Error:
         return []
 
-    with _cache_lock:
-        needs_refresh = (current_count != _children_count) or (not _children_ips_cache)
+def _get_child(ip):
+    devices = _devices.by_address(ip)
+    return devices[0] if devices else None
+
+# Estrategia por defecto: "get" (GET completo), "head" o "tcp" (sólo connect)
+_DEFAULT_PROBE_STRATEGY = _settings.probe_strategy
+
+def _get_child_strategy(ip):
+    """Lee {"probe": "tcp" | "head" | "get"} del config del dispositivo."""
+    child = _get_child(ip)
+    strategy = child.config.get("probe") if child else None
+    return strategy if strategy in server.serverlib.probe.STRATEGIES else _DEFAULT_PROBE_STRATEGY
+
+_health = server.serverlib.health.get_health_tracker()
+_rtt = server.serverlib.health.get_rtt_tracker()
+
+# Backend de sondeo: "threads" (requests) o "asyncio" (miles de sondas en un hilo)
+# Los timeouts de cada hijo salen de su historial de RTT
+_probe = server.serverlib.probe.get_probe(
+    _settings.probe_backend, timeouts=_rtt.timeouts, strategies=_get_child_strategy,
+    endpoints=server.serverlib.children.resolve_endpoint,
+    concurrency=_settings.probe_in_flight if _settings.probe_backend == "asyncio" else _settings.probe_threads
+)
+
+_heartbeats = server.serverlib.heartbeat.get_heartbeat_registry()
+
+# Intervalo anunciado por el cliente, acotado por el servidor
+_HEARTBEAT_MIN_INTERVAL = 1.0
+_HEARTBEAT_MAX_INTERVAL = max(_settings.heartbeat_max_interval, _HEARTBEAT_MIN_INTERVAL)
 
-    if needs_refresh:
-        _update_children_cache()
+def _verify_heartbeat_key(candidate):
+    """Clave propia de los heartbeats, para no repartir la clave de administración a los clientes."""
+    key = _settings.heartbeat_key
+    if key and candidate and hmac.compare_digest(candidate.encode(), key.encode()):
+        return True
+    return server.serverlib.apikey.get_api_key_store().verify(candidate)
 
-    with _cache_lock:
-        return list(_children_ips_cache)  # copia segura
+def _heartbeat_address(ip):
+    """Dirección del dispositivo guardado que envía el heartbeat, o None si no hay uno solo."""
+    if _devices.by_address(ip):
+        return ip
+    addresses = set(device.address for device in _devices.by_ip(ip))
+    return addresses.pop() if len(addresses) == 1 else None
 
-def _check_child(session: requests.Session, ip: str):
-    url = f"http://{ip}:5154/info/status"
+# "probe": sondeo HTTP (heartbeats recientes lo evitan); "heartbeat": sólo heartbeats, sin sondeo
+_STATUS_SOURCE = _settings.status_source
+
+# Tabla de vecinos del kernel (Linux): "off", "prefilter" (FAILED se da por caído
+# sin sondear) o "neighbors" (sólo la tabla, sin sondeo HTTP)
+_PRESENCE = _settings.presence
+_neighbors = server.serverlib.neighbors.NeighborTable(ttl=_settings.neighbor_ttl)
+
+def _neighbor_state(ip):
+    if _PRESENCE == "off":
+        return None
+    child = _get_child(ip)
+    # Las entradas FAILED no tienen MAC, sólo se encuentran por la IP
+    return _neighbors.state(child.mac, child.ip) if child else None
+
+def _probe_children(on_result=None):
+    ips = _get_children_ips()
+    results = {}
+
+    def collect(child):
+        _health.record(child["ip"], child["status"])
+        if child["status"]:
+            _rtt.record(child["ip"], child["rtt_ms"] / 1000)
+        elif child.get("timed_out"):
+            _rtt.record_timeout(child["ip"])
+        report(child)
+
+    def report(child):
+        results[child["ip"]] = child
+        if on_result is not None:
+            on_result(child)
+
+    # Heartbeat reciente: vivo sin sondear. Circuito abierto: caído sin sondear
+    to_probe = []
+    for ip in ips:
+        neighbor = _neighbor_state(ip)
+        if _heartbeats.is_alive(ip):
+            report({"ip": ip, "status": True, "heartbeat_at": _heartbeats.last_seen(ip)})
+        elif _STATUS_SOURCE == "heartbeat":
+            report({"ip": ip, "status": False, "heartbeat_at": _heartbeats.last_seen(ip)})
+        elif _PRESENCE == "neighbors":
+            report({"ip": ip, "status": neighbor in server.serverlib.neighbors.UP_STATES, "neighbor": neighbor})
+        elif not _health.should_probe(ip):
+            report({"ip": ip, "status": False, "suspended": True})
+        elif neighbor == server.serverlib.neighbors.FAILED and 0 < _health.failures(ip) < _health.threshold:
+            # FAILED cuenta como sondeo fallido y sigue el backoff. Tras un wake, un
+            # heartbeat o al vencer el backoff se sondea de verdad: sin tráfico el
+            # kernel no vuelve a resolver la entrada
+            _health.record(ip, False)
+            report({"ip": ip, "status": False, "neighbor": neighbor})
+        else:
+            to_probe.append(ip)
+
+    _probe.probe(to_probe, on_result=collect)
+    return [results[ip] for ip in ips]
+
+# Sondeo en segundo plano: /info/status responde desde la última foto
+# Las rondas concurrentes se comparten y se reutilizan durante status_reuse_window
+# Con prefork sólo un worker sondea, el resto lee su foto junto a la base
+monitor = server.serverlib.monitor.StatusMonitor(
+    _probe_children,
+    interval=_settings.status_interval,
+    reuse_window=_settings.status_reuse_window,
+    shared=server.serverlib.monitor.SharedStatus(_database.path.parent) if _settings.serve == "prefork" else None,
+)
+
+# Tope de latencia para /info/status en vivo (balanceadores de carga)
+# El cliente puede pedir menos, nunca más
+_STATUS_DEADLINE = _settings.status_deadline
+
+def _request_deadline():
     try:
-        # timeout=(connect, read)
-        r = session.get(url, timeout=(0.5, 0.8))
-        ok = (r.status_code == 200)
-    except requests.RequestException:
-        ok = False
-    return {"ip": ip, "status": ok}
-
-@info.route("/info/status", methods=["GET"])
+        deadline = float(flask.request.args.get("deadline", _STATUS_DEADLINE))
+    except ValueError:
+        deadline = _STATUS_DEADLINE
+    if not math.isfinite(deadline):
+        deadline = _STATUS_DEADLINE
+    return min(max(deadline, 0.0), _STATUS_DEADLINE)
+
+def _missing_child(ip, last_known):
+    if ip in last_known:
+        return dict(last_known[ip], stale=True)
+    return {"ip": ip, "status": "pending"}
+
+def _last_known():
+    snapshot = monitor.snapshot()
+    return {c["ip"]: c for c in snapshot["children"]} if snapshot else {}
+
+def _partial_children(probe_round):
+    """Lo que llegó antes del deadline; el resto, último valor conocido o pendiente."""
+    results = probe_round.results()
+    last_known = _last_known()
+    return [
+        results[ip] if ip in results else _missing_child(ip, last_known)
+        for ip in _get_children_ips()
+    ]
+
+def _stream_status(snapshot, deadline):
+    """Una línea JSON por hijo, en el orden en que responden."""
+    def generate(probe_round):
+        seen = set()
+        for child in probe_round.follow(deadline):
+            seen.add(child["ip"])
+            yield json.dumps(child) + "\n"
+
+        if not probe_round.done():
+            last_known = _last_known()
+            for ip in _get_children_ips():
+                if ip not in seen:
+                    yield json.dumps(_missing_child(ip, last_known)) + "\n"
+
+    probe_round = (
+        server.serverlib.monitor.ProbeRound.completed(snapshot)
+        if snapshot is not None else monitor.start_round()
+    )
+    return flask.Response(generate(probe_round), mimetype="application/x-ndjson")
+
+def _status_etag(snapshot):
+    """Versión y hora de la foto, iguales en todos los workers que la comparten."""
+    return server.serverlib.etag.make("status", snapshot["version"], snapshot["updated_at"])
+
+@info.route("/info/status", methods=["GET", "HEAD"])
 def status():
+    if flask.request.method == "HEAD":
+        # Sonda barata del servidor padre: sin consultar ni sondear hijos
+        return flask.Response(status=200)
+
     try:
         is_server = check_server_status_cached()
         if not is_server:
             return flask.json.jsonify(status=True)
 
-        ips = _get_children_ips()
+        fresh = flask.request.args.get("fresh") in ("1", "true")
+        snapshot = None if fresh or not monitor.is_running() else monitor.snapshot()
+
+        if flask.request.args.get("format") == "ndjson":
+            return _stream_status(snapshot, _request_deadline())
 
-        # Concurrencia: ajusta según tu #children y hardware
-        max_workers = min(32, max(4, len(ips)))  # ejemplo
-        children_status = []
+        if snapshot is not None:
+            etag = _status_etag(snapshot)
+            if server.serverlib.etag.matches(etag):
+                return server.serverlib.etag.not_modified(etag)
+            return server.serverlib.etag.tag(flask.json.jsonify(
+                status=True,
+                children=snapshot["children"],
+                updated_at=snapshot["updated_at"]
+            ), etag)
 
-        with requests.Session() as session:
-            adapter = requests.adapters.HTTPAdapter(
-                pool_connections=64, pool_maxsize=64, max_retries=0
+        # ?fresh=1, monitor apagado o aún sin su primera ronda
+        probe_round = monitor.start_round()
+        if not probe_round.wait(_request_deadline()):
+            # La ronda sigue en segundo plano y actualizará la foto al terminar
+            return flask.json.jsonify(
+                status=True,
+                complete=False,
+                children=_partial_children(probe_round)
             )
-            session.mount("http://", adapter)
 
-            with ThreadPoolExecutor(max_workers=max_workers) as ex:
-                futures = [ex.submit(_check_child, session, ip) for ip in ips]
-                for f in as_completed(futures):
-                    children_status.append(f.result())
+        if probe_round.error is not None:
+            raise probe_round.error
 
-        overall = all(c["status"] for c in children_status)
-        # opcional: ordenar para respuesta estable
-        return flask.json.jsonify(status=True, children=children_status)
+        etag = _status_etag(probe_round.snapshot)
+        if server.serverlib.etag.matches(etag):
+            return server.serverlib.etag.not_modified(etag)
+        return server.serverlib.etag.tag(flask.json.jsonify(
+            status=True,
+            complete=True,
+            children=probe_round.snapshot["children"],
+            updated_at=probe_round.snapshot["updated_at"]
+        ), etag)
 
     except sqlite3.Error as e:
         return flask.json.jsonify(status=False, error=str(e))
     except Exception as e:
         return flask.json.jsonify(status=False, error=str(e))
 
+# Comentario SSE cada tanto para que proxies no cierren la conexión
+_SSE_KEEPALIVE = 15.0
+
+def _stream_slots():
+    """
+    Cada stream ocupa un hilo del pool mientras está conectado. Con un pool
+    fijo (threaded, prefork) se deja al menos la mitad para el resto de rutas,
+    salvo con un solo hilo, donde un stream puede ocuparlo.
+    """
+    if _settings.stream_listeners:
+        return threading.BoundedSemaphore(_settings.stream_listeners)
+    if _settings.serve == "development":
+        return None
+    return threading.BoundedSemaphore(max(_settings.threads // 2, 1))
+
+_STREAM_SLOTS = _stream_slots()
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@info.route("/info/status/stream", methods=["GET"])
+def status_stream():
+    if not check_server_status_cached():
+        return flask.json.jsonify(status=False, error="Method allowed only in server mode.")
+
+    # Rechazar antes de que los streams ocupen todo el pool y el servidor deje de responder
+    if _STREAM_SLOTS is not None and not _STREAM_SLOTS.acquire(blocking=False):
+        response = flask.json.jsonify(status=False, error="Too many status stream listeners, try again later.")
+        response.headers["Retry-After"] = str(int(_SSE_KEEPALIVE))
+        return response, 503
+
+    # Todas las conexiones comparten el mismo monitor, ninguna sondea por su cuenta
+    try:
+        monitor.start()
+        events = monitor.subscribe()
+    except Exception:
+        if _STREAM_SLOTS is not None:
+            _STREAM_SLOTS.release()
+        raise
+
+    def generate():
+        snapshot = monitor.snapshot()
+        if snapshot is not None:
+            yield _sse("snapshot", snapshot)
+        while True:
+            try:
+                event, data = events.get(timeout=_SSE_KEEPALIVE)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            # "snapshot" otra vez si el cliente se quedó atrás y se perdieron cambios
+            yield _sse(event, data)
+
+    response = flask.Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+    # También si el cliente se va antes de recibir el primer evento
+    @response.call_on_close
+    def release():
+        monitor.unsubscribe(events)
+        if _STREAM_SLOTS is not None:
+            _STREAM_SLOTS.release()
+
+    return response
+
+@info.route("/info/heartbeat", methods=["POST"])
+def heartbeat():
+    if not check_server_status_cached():
+        return flask.json.jsonify(status=False, error="Method allowed only in server mode."), 400
+
+    if not _verify_heartbeat_key(flask.request.headers.get("Authorization")):
+        return flask.json.jsonify(status=False, error="Invalid API key."), 403
+
+    data = flask.request.get_json(silent=True) or {}
+    try:
+        interval = float(data.get("interval", 10.0))
+    except (TypeError, ValueError):
+        return flask.json.jsonify(status=False, error="Invalid field: interval."), 400
+    if not math.isfinite(interval):
+        return flask.json.jsonify(status=False, error="Invalid field: interval."), 400
+    interval = min(max(interval, _HEARTBEAT_MIN_INTERVAL), _HEARTBEAT_MAX_INTERVAL)
+
+    # Sólo dispositivos guardados: nadie llena el registro con IPs inventadas
+    ip = _heartbeat_address(str(data.get("ip") or flask.request.remote_addr))
+    if ip is None:
+        return flask.json.jsonify(status=False, error="Unknown device."), 404
+
+    _heartbeats.record(ip, interval)
+    _health.reset(ip)
+    return flask.json.jsonify(status=True)
+
+@info.route("/info/rtt", methods=["GET"])
+def rtt():
+    if not check_server_status_cached():
+        return flask.json.jsonify(status=False, error="Method allowed only in server mode.")
+
+    return flask.json.jsonify(
+        status=True,
+        min_timeout_ms=_rtt.min_timeout * 1000,
+        max_timeout_ms=_rtt.max_timeout * 1000,
+        children=_rtt.stats()
+    )
+
 @info.route("/info/version", methods=["GET"])
 def version():
     try:
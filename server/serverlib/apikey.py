@@ -0,0 +1,90 @@
+"""apikey.py: In-process API key store"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import hmac
+import threading
+import typing
+
+import server.serverlib.database
+
+API_KEY_SETTING = "api_key"
+
+_NOT_LOADED = object()
+
+
+class ApiKeyStore:
+    """
+    Keeps the stored API key in memory after the first lookup.
+
+    The ``settings`` row is read once; afterwards verification is a constant
+    time comparison against the cached value. ``set()`` writes through and
+    ``invalidate()`` forces the next check to reload from the database.
+    """
+
+    def __init__(self, database: server.serverlib.database.Database):
+        self.database = database
+        self._lock = threading.Lock()
+        self._api_key: typing.Any = _NOT_LOADED
+
+    def get(self) -> typing.Optional[str]:
+        api_key = self._api_key
+        if api_key is not _NOT_LOADED:
+            return api_key
+
+        with self._lock:
+            if self._api_key is _NOT_LOADED:
+                if not self.database.exists():
+                    # Nothing to cache yet, the server is not set up
+                    return None
+                self._api_key = self._load()
+            return self._api_key
+
+    def verify(self, candidate: typing.Optional[str]) -> bool:
+        if not candidate:
+            return False
+
+        stored_api_key = self.get()
+        if not stored_api_key:
+            return False
+
+        return hmac.compare_digest(candidate.encode(), stored_api_key.encode())
+
+    def set(self, api_key: str) -> None:
+        with self._lock:
+            with self.database.connection() as connection:
+                with connection:
+                    connection.execute(
+                        """
+                        INSERT OR REPLACE INTO settings (key, value)
+                        VALUES (?, ?)
+                        """,
+                        (API_KEY_SETTING, api_key)
+                    )
+            self._api_key = api_key
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._api_key = _NOT_LOADED
+
+    def _load(self) -> typing.Optional[str]:
+        with self.database.connection() as connection:
+            row = connection.execute(
+                "SELECT value FROM settings WHERE key = ?", (API_KEY_SETTING,)
+            ).fetchone()
+        return row[0] if row else None
+
+
+_store: typing.Optional[ApiKeyStore] = None
+_store_lock = threading.Lock()
+
+
+def get_api_key_store() -> ApiKeyStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ApiKeyStore(server.serverlib.database.get_database())
+        return _store
@@ -0,0 +1,132 @@
+"""children.py: Outbound HTTP calls from the server to client devices"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import time
+import typing
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import requests.adapters
+
+import server.serverlib.endpoint
+import server.serverlib.registry
+import server.serverlib.settings
+
+Endpoints = typing.Callable[[str], server.serverlib.endpoint.Endpoint]
+
+
+class AmbiguousAddress(ValueError):
+    """Raised for a bare IP shared by devices that listen on different endpoints."""
+
+
+def resolve_endpoint(address: str) -> server.serverlib.endpoint.Endpoint:
+    """
+    Endpoint of the stored device with this address, else of the stored
+    devices with this IP, else one parsed from the address itself. Raises
+    ``AmbiguousAddress`` when the IP alone does not tell the devices apart.
+    """
+    registry = server.serverlib.registry.get_device_registry()
+    devices = registry.by_address(address)
+    if devices:
+        return devices[0].endpoint
+
+    # Callers may name a device by the ip shown in device/list, its port lives in config
+    endpoints = set(device.endpoint for device in registry.by_ip(address))
+    if len(endpoints) == 1:
+        return endpoints.pop()
+    if endpoints:
+        names = ", ".join(sorted(endpoint.address for endpoint in endpoints))
+        raise AmbiguousAddress(f"Several devices use {address}, name one of: {names}.")
+    return server.serverlib.endpoint.parse(address)
+
+
+def child_url(address: str, path: str) -> str:
+    return resolve_endpoint(address).url(path)
+
+
+class ChildClient:
+    """
+    Keep-alive HTTP session plus a bounded worker pool for talking to children.
+
+    Both are created lazily and reused across requests, so a bulk command
+    costs one TCP handshake per child at most and never more than
+    ``max_workers`` threads. Children are named by address and reached at
+    whatever ``endpoints`` resolves it to.
+    """
+
+    def __init__(self, max_workers: int = 32, timeout: float = 5.0, endpoints: typing.Optional[Endpoints] = None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.endpoints = endpoints or server.serverlib.endpoint.parse
+        self._lock = threading.Lock()
+        self._session: typing.Optional[requests.Session] = None
+        self._executor: typing.Optional[ThreadPoolExecutor] = None
+
+    @property
+    def session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=self.max_workers, pool_maxsize=self.max_workers, max_retries=0
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="children"
+                )
+            return self._executor
+
+    def post(self, address: str, path: str) -> requests.Response:
+        return self.session.post(self.endpoints(address).url(path), timeout=self.timeout)
+
+    def post_many(self, addresses: typing.Iterable[str], path: str) -> typing.List[dict]:
+        """POST ``path`` to every child concurrently, results keep the input order."""
+        futures = [self.executor.submit(self._timed_post, address, path) for address in addresses]
+        return [future.result() for future in futures]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _timed_post(self, address: str, path: str) -> dict:
+        started = time.monotonic()
+        try:
+            response = self.post(address, path)
+            result = {"ip": address, "status": response.status_code == 200, "status_code": response.status_code}
+        except (requests.RequestException, AmbiguousAddress) as e:
+            result = {"ip": address, "status": False, "error": str(e)}
+        result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        return result
+
+
+_client: typing.Optional[ChildClient] = None
+_client_lock = threading.Lock()
+
+
+def get_child_client() -> ChildClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            settings = server.serverlib.settings.get_settings()
+            _client = ChildClient(
+                max_workers=settings.child_workers, timeout=settings.child_timeout, endpoints=resolve_endpoint
+            )
+        return _client
@@ -0,0 +1,127 @@
+"""database.py: Shared SQLite data layer for server blueprints"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import queue
+import sqlite3
+import logging
+import pathlib
+import threading
+import contextlib
+import typing
+
+import server.serverlib.migrations
+import server.serverlib.settings
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_db_path(settings: typing.Optional[server.serverlib.settings.Settings] = None) -> pathlib.Path:
+    settings = settings or server.serverlib.settings.get_settings()
+    if settings.db_path:
+        return pathlib.Path(settings.db_path).expanduser()
+
+    if settings.data_dir:
+        return pathlib.Path(settings.data_dir).expanduser() / "devices.db"
+
+    return pathlib.Path(__file__).resolve().parent.parent / "data" / "devices.db"
+
+
+class Database:
+    """
+    Pool of long-lived SQLite connections shared by all request threads.
+
+    A connection is checked out for the duration of a ``with`` block and
+    returned to the pool afterwards, so request handlers never pay for
+    ``sqlite3.connect`` or schema DDL. The database file itself marks the
+    server mode, so nothing here creates it except ``initialize()``.
+    """
+
+    def __init__(self, path: pathlib.Path, pool_size: int = 8):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def initialize(self) -> int:
+        """
+        Create the database file if needed and bring its schema up to date.
+
+        Runs once at startup (and on setup); request handlers assume the
+        schema is ready. Returns the schema version.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.connection() as connection:
+            version = server.serverlib.migrations.migrate(connection)
+        logger.info(f"database is ready at {self.path}, schema version {version}")
+        return version
+
+    @contextlib.contextmanager
+    def connection(self) -> typing.Iterator[sqlite3.Connection]:
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            connection = self._open()
+
+        try:
+            yield connection
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            self._release(connection)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+        self.drain()
+
+    def drain(self) -> None:
+        """
+        Close the idle pooled connections; the pool refills on demand.
+
+        Must be called before forking, SQLite connections cannot cross a fork.
+        """
+        while True:
+            try:
+                connection = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+
+    def _open(self) -> sqlite3.Connection:
+        # Connections travel between request threads, but only one thread
+        # holds a given connection at a time
+        connection = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _release(self, connection: sqlite3.Connection) -> None:
+        with self._lock:
+            keep = not self._closed and self._pool.qsize() < self.pool_size
+
+        if keep:
+            self._pool.put(connection)
+        else:
+            connection.close()
+
+
+_database: typing.Optional[Database] = None
+_database_lock = threading.Lock()
+
+
+def get_database() -> Database:
+    global _database
+    with _database_lock:
+        if _database is None:
+            settings = server.serverlib.settings.get_settings()
+            _database = Database(resolve_db_path(settings), pool_size=settings.db_pool_size)
+        return _database
@@ -0,0 +1,81 @@
+"""endpoint.py: Where a child device is reached, per device"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import typing
+
+import server.serverlib.settings
+
+SCHEMES = ("http", "https")
+
+
+def default_port() -> int:
+    """Port the client instances listen on, ``child_port`` in the settings."""
+    return server.serverlib.settings.get_settings().child_port
+
+
+class Endpoint(typing.NamedTuple):
+    host: str
+    port: int
+    scheme: str = "http"
+    base_path: str = ""
+
+    @property
+    def address(self) -> str:
+        """
+        Name of the child in status results and commands: the bare host on
+        the default port, ``host:port`` otherwise, so several instances can
+        share one host.
+        """
+        if self.port == default_port():
+            return self.host
+        return f"{_netloc_host(self.host)}:{self.port}"
+
+    def url(self, path: str) -> str:
+        return f"{self.scheme}://{_netloc_host(self.host)}:{self.port}{self.base_path}{path}"
+
+
+def from_config(ip: str, config: typing.Optional[dict]) -> Endpoint:
+    """
+    Endpoint from the ``port``, ``scheme`` and ``base_path`` keys of a device
+    config, each optional. Raises ``ValueError`` for invalid values.
+    """
+    config = config or {}
+
+    port = config.get("port", default_port())
+    if isinstance(port, bool) or not isinstance(port, int) or not 0 < port < 65536:
+        raise ValueError(f"Invalid field: config.port must be a TCP port number, got {port!r}.")
+
+    scheme = config.get("scheme", "http")
+    if scheme not in SCHEMES:
+        raise ValueError(f"Invalid field: config.scheme must be one of: {', '.join(SCHEMES)}.")
+
+    base_path = config.get("base_path", "")
+    if not isinstance(base_path, str) or (base_path and not base_path.startswith("/")):
+        raise ValueError("Invalid field: config.base_path must be a path starting with /.")
+
+    return Endpoint(ip, port, scheme, base_path.rstrip("/"))
+
+
+def parse(address: str) -> Endpoint:
+    """Endpoint of an address with no stored device behind it: ``host``, ``host:port`` or ``[v6]:port``."""
+    host, port = address, default_port()
+    if address.startswith("["):
+        bracket = address.find("]")
+        if bracket != -1:
+            host = address[1:bracket]
+            rest = address[bracket + 1:]
+            if rest.startswith(":") and rest[1:].isdigit():
+                port = int(rest[1:])
+    elif address.count(":") == 1:
+        name, _, number = address.partition(":")
+        if number.isdigit():
+            host, port = name, int(number)
+    return Endpoint(host, port)
+
+
+def _netloc_host(host: str) -> str:
+    return f"[{host}]" if ":" in host else host
@@ -0,0 +1,37 @@
+"""etag.py: Conditional GET helpers shared by the blueprints"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import hashlib
+import secrets
+
+import flask
+
+# Distinguishes tags of this process from tags handed out before a restart,
+# for values such as in-memory counters that start over with the process
+PROCESS_EPOCH = secrets.token_hex(4)
+
+
+def make(*parts) -> str:
+    """Opaque tag for a response that depends only on ``parts`` and the query string."""
+    digest = hashlib.sha1(flask.request.query_string).hexdigest()[:12]
+    return "-".join(str(part) for part in parts) + "-" + digest
+
+
+def matches(etag: str) -> bool:
+    """True when the client already holds this version (weak comparison, RFC 9110)."""
+    return flask.request.if_none_match.contains_weak(etag)
+
+
+def not_modified(etag: str) -> flask.Response:
+    return tag(flask.Response(status=304), etag)
+
+
+def tag(response: flask.Response, etag: str) -> flask.Response:
+    response.set_etag(etag)
+    # Stored copies must be revalidated, which is what the tag makes cheap
+    response.headers["Cache-Control"] = "no-cache"
+    return response
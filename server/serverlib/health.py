@@ -0,0 +1,214 @@
+"""health.py: Failure and response time tracking for children"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import time
+import typing
+import logging
+import sqlite3
+import threading
+
+import server.serverlib.database
+import server.serverlib.settings
+
+logger = logging.getLogger(__name__)
+
+
+class HealthTracker:
+    """
+    Per-child circuit breaker.
+
+    After ``threshold`` consecutive failed probes a child is considered down
+    and is not probed again until its backoff expires. The backoff doubles
+    with every further failure, from ``base_backoff`` up to ``max_backoff``
+    seconds. ``reset()`` closes the breaker, e.g. right after a wake packet.
+
+    With a ``database`` resets are also stored in the ``health_resets`` table,
+    so a wake handled by one worker process closes the breaker of the worker
+    that probes, at most ``ttl`` seconds later.
+    """
+
+    def __init__(self, threshold: int = 3, base_backoff: float = 5.0, max_backoff: float = 300.0,
+                 database: typing.Optional[server.serverlib.database.Database] = None, ttl: float = 1.0):
+        self.threshold = threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.database = database
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._failures: typing.Dict[str, int] = {}
+        self._retry_at: typing.Dict[str, float] = {}
+        # Wall clock time of the last reset applied to every child
+        self._reset_at: typing.Dict[str, float] = {}
+        self._synced_at = 0.0
+
+    def should_probe(self, ip: str, now: typing.Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self._sync()
+        with self._lock:
+            return self._retry_at.get(ip, 0.0) <= now
+
+    def record(self, ip: str, ok: bool, now: typing.Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if ok:
+                self._failures.pop(ip, None)
+                self._retry_at.pop(ip, None)
+                return
+
+            failures = self._failures.get(ip, 0) + 1
+            self._failures[ip] = failures
+            if failures >= self.threshold:
+                backoff = self.base_backoff * 2 ** (failures - self.threshold)
+                self._retry_at[ip] = now + min(backoff, self.max_backoff)
+
+    def reset(self, ip: str) -> None:
+        reset_at = time.time()
+        with self._lock:
+            self._failures.pop(ip, None)
+            self._retry_at.pop(ip, None)
+            self._reset_at[ip] = reset_at
+        if self.database is None:
+            return
+
+        try:
+            with self.database.connection() as connection:
+                with connection:
+                    connection.execute(
+                        """
+                        INSERT INTO health_resets (address, reset_at) VALUES (?, ?)
+                        ON CONFLICT (address) DO UPDATE SET reset_at = excluded.reset_at
+                        """,
+                        (ip, reset_at)
+                    )
+        except sqlite3.Error as e:
+            logger.error(f"cannot share health reset of {ip}: {e}")
+
+    def failures(self, ip: str) -> int:
+        self._sync()
+        with self._lock:
+            return self._failures.get(ip, 0)
+
+    def _sync(self) -> None:
+        """Apply the resets done by other worker processes since they were last read."""
+        if self.database is None or time.monotonic() - self._synced_at < self.ttl:
+            return
+
+        try:
+            with self.database.connection() as connection:
+                rows = connection.execute("SELECT address, reset_at FROM health_resets").fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"cannot read shared health resets: {e}")
+            rows = []
+
+        with self._lock:
+            for address, reset_at in rows:
+                if reset_at > self._reset_at.get(address, 0.0):
+                    self._failures.pop(address, None)
+                    self._retry_at.pop(address, None)
+                    self._reset_at[address] = reset_at
+            self._synced_at = time.monotonic()
+
+
+class RttTracker:
+    """
+    Smoothed response time per child, used to size its probe timeouts.
+
+    Follows the TCP retransmission timer: ``srtt`` and ``rttvar`` are EWMAs
+    of the samples and the timeout is ``srtt + 4 * rttvar`` clamped to
+    ``[min_timeout, max_timeout]``. Every timeout doubles the next one until
+    a successful sample arrives, so a slow child is not starved forever.
+    """
+
+    def __init__(self, min_timeout: float = 0.1, max_timeout: float = 2.0,
+                 default_timeouts: typing.Tuple[float, float] = (0.5, 0.8),
+                 alpha: float = 0.125, beta: float = 0.25):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.default_timeouts = default_timeouts
+        self.alpha = alpha
+        self.beta = beta
+        self._lock = threading.Lock()
+        self._stats: typing.Dict[str, dict] = {}
+
+    def record(self, ip: str, rtt: float) -> None:
+        with self._lock:
+            stats = self._stats.get(ip)
+            if stats is None:
+                self._stats[ip] = {"srtt": rtt, "rttvar": rtt / 2, "samples": 1, "backoff": 1}
+                return
+
+            stats["rttvar"] = (1 - self.beta) * stats["rttvar"] + self.beta * abs(stats["srtt"] - rtt)
+            stats["srtt"] = (1 - self.alpha) * stats["srtt"] + self.alpha * rtt
+            stats["samples"] += 1
+            stats["backoff"] = 1
+
+    def record_timeout(self, ip: str) -> None:
+        with self._lock:
+            stats = self._stats.get(ip)
+            if stats is not None and self._timeout(stats) < self.max_timeout:
+                stats["backoff"] *= 2
+
+    def timeouts(self, ip: str) -> typing.Tuple[float, float]:
+        """(connect, read) timeouts in seconds."""
+        with self._lock:
+            stats = self._stats.get(ip)
+            if stats is None:
+                return self.default_timeouts
+            timeout = self._timeout(stats)
+        return timeout, timeout
+
+    def stats(self) -> typing.Dict[str, dict]:
+        with self._lock:
+            return {
+                ip: {
+                    "srtt_ms": round(stats["srtt"] * 1000, 2),
+                    "rttvar_ms": round(stats["rttvar"] * 1000, 2),
+                    "samples": stats["samples"],
+                    "timeout_ms": round(self._timeout(stats) * 1000, 2),
+                }
+                for ip, stats in self._stats.items()
+            }
+
+    def _timeout(self, stats: dict) -> float:
+        timeout = (stats["srtt"] + 4 * stats["rttvar"]) * stats["backoff"]
+        return min(max(timeout, self.min_timeout), self.max_timeout)
+
+
+_tracker: typing.Optional[HealthTracker] = None
+_tracker_lock = threading.Lock()
+
+
+def get_health_tracker() -> HealthTracker:
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            settings = server.serverlib.settings.get_settings()
+            _tracker = HealthTracker(
+                threshold=settings.health_threshold,
+                base_backoff=settings.health_backoff,
+                max_backoff=settings.health_max_backoff,
+                # Prefork: wakes land on any worker, probes run on one
+                database=server.serverlib.database.get_database() if settings.serve == "prefork" else None,
+                ttl=settings.registry_ttl,
+            )
+        return _tracker
+
+
+_rtt_tracker: typing.Optional[RttTracker] = None
+
+
+def get_rtt_tracker() -> RttTracker:
+    global _rtt_tracker
+    with _tracker_lock:
+        if _rtt_tracker is None:
+            settings = server.serverlib.settings.get_settings()
+            _rtt_tracker = RttTracker(
+                min_timeout=settings.probe_timeout_min,
+                max_timeout=settings.probe_timeout_max,
+                default_timeouts=(settings.probe_connect_timeout, settings.probe_read_timeout),
+            )
+        return _rtt_tracker
@@ -0,0 +1,163 @@
+"""heartbeat.py: Push-based liveness between clients and server"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import time
+import typing
+import logging
+import sqlite3
+import threading
+
+import requests
+
+import server.serverlib.database
+import server.serverlib.settings
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_PATH = "/info/heartbeat"
+
+# A child is alive while its last heartbeat is younger than this many intervals
+MISSED_HEARTBEATS = 3
+
+
+class HeartbeatRegistry:
+    """
+    Server side: arrival time of the last heartbeat of every child.
+
+    With a ``database`` every heartbeat is also stored in the ``heartbeats``
+    table, and reads pick up the ones received by other worker processes at
+    most ``ttl`` seconds late.
+    """
+
+    def __init__(self, database: typing.Optional[server.serverlib.database.Database] = None, ttl: float = 1.0):
+        self.database = database
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._seen: typing.Dict[str, typing.Tuple[float, float]] = {}
+        self._read_at = 0.0
+
+    def record(self, ip: str, interval: float) -> None:
+        seen_at = time.time()
+        with self._lock:
+            self._seen[ip] = (seen_at, interval)
+        if self.database is None:
+            return
+
+        try:
+            with self.database.connection() as connection:
+                with connection:
+                    connection.execute(
+                        """
+                        INSERT INTO heartbeats (address, seen_at, interval) VALUES (?, ?, ?)
+                        ON CONFLICT (address) DO UPDATE SET seen_at = excluded.seen_at, interval = excluded.interval
+                        """,
+                        (ip, seen_at, interval)
+                    )
+        except sqlite3.Error as e:
+            logger.error(f"cannot share heartbeat of {ip}: {e}")
+
+    def is_alive(self, ip: str, now: typing.Optional[float] = None) -> bool:
+        now = time.time() if now is None else now
+        seen = self._get(ip)
+        if seen is None:
+            return False
+        last_seen, interval = seen
+        return now - last_seen <= interval * MISSED_HEARTBEATS
+
+    def last_seen(self, ip: str) -> typing.Optional[float]:
+        seen = self._get(ip)
+        return seen[0] if seen else None
+
+    def _get(self, ip: str) -> typing.Optional[typing.Tuple[float, float]]:
+        self._refresh()
+        with self._lock:
+            return self._seen.get(ip)
+
+    def _refresh(self) -> None:
+        if self.database is None or time.monotonic() - self._read_at < self.ttl:
+            return
+
+        try:
+            with self.database.connection() as connection:
+                rows = connection.execute("SELECT address, seen_at, interval FROM heartbeats").fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"cannot read shared heartbeats: {e}")
+            rows = []
+
+        with self._lock:
+            for address, seen_at, interval in rows:
+                if seen_at > self._seen.get(address, (0.0, 0.0))[0]:
+                    self._seen[address] = (seen_at, interval)
+            self._read_at = time.monotonic()
+
+
+class HeartbeatSender:
+    """
+    Client side: POSTs a small heartbeat to the server every ``interval`` seconds.
+
+    ``lead`` tells whether this process is the one that sends, so worker
+    processes that all run a sender still send one heartbeat per interval.
+    """
+
+    def __init__(self, server_url: str, api_key: str, interval: float = 10.0, ip: typing.Optional[str] = None,
+                 lead: typing.Optional[typing.Callable[[], bool]] = None):
+        self.url = server_url.rstrip("/") + HEARTBEAT_PATH
+        self.api_key = api_key
+        self.interval = interval
+        self.ip = ip
+        self.lead = lead
+        self._stop = threading.Event()
+        self._thread: typing.Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+        self._thread.start()
+        logger.info(f"sending heartbeats to {self.url} every {self.interval}s")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+
+    def _run(self) -> None:
+        payload = {"interval": self.interval}
+        if self.ip:
+            payload["ip"] = self.ip
+
+        with requests.Session() as session:
+            session.headers["Authorization"] = self.api_key
+            while not self._stop.is_set():
+                if self.lead is not None and not self.lead():
+                    self._stop.wait(self.interval)
+                    continue
+                try:
+                    response = session.post(self.url, json=payload, timeout=min(self.interval, 5.0))
+                    if response.status_code != 200:
+                        logger.warning(f"heartbeat rejected by server: {response.status_code}")
+                except requests.RequestException as e:
+                    logger.warning(f"cannot send heartbeat: {e}")
+                self._stop.wait(self.interval)
+
+
+_registry: typing.Optional[HeartbeatRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_heartbeat_registry() -> HeartbeatRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            settings = server.serverlib.settings.get_settings()
+            # Prefork: the worker that receives a heartbeat is rarely the one that probes
+            database = server.serverlib.database.get_database() if settings.serve == "prefork" else None
+            _registry = HeartbeatRegistry(database, ttl=settings.registry_ttl)
+        return _registry
@@ -0,0 +1,177 @@
+"""inventory.py: Device inventory import and export formats"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import io
+import csv
+import json
+import typing
+
+import lib.magic_packet
+import server.serverlib.endpoint
+
+FORMAT_JSON = "json"
+FORMAT_NDJSON = "ndjson"
+FORMAT_CSV = "csv"
+FORMATS = (FORMAT_JSON, FORMAT_NDJSON, FORMAT_CSV)
+
+MIMETYPES = {
+    FORMAT_JSON: "application/json",
+    FORMAT_NDJSON: "application/x-ndjson",
+    FORMAT_CSV: "text/csv",
+}
+
+CSV_COLUMNS = ("ip", "mac", "config")
+
+_FORMATS_BY_MIMETYPE = {
+    "application/json": FORMAT_JSON,
+    "application/x-ndjson": FORMAT_NDJSON,
+    "application/ndjson": FORMAT_NDJSON,
+    "application/jsonlines": FORMAT_NDJSON,
+    "text/csv": FORMAT_CSV,
+}
+
+
+class Record(typing.NamedTuple):
+    ip: str
+    mac: int
+    config: dict
+
+
+class InventoryError(ValueError):
+    """Raised with every rejected row, so a file can be fixed in one pass."""
+
+    def __init__(self, errors: typing.List[dict]):
+        super().__init__(f"{len(errors)} invalid rows")
+        self.errors = errors
+
+
+def format_for_mimetype(mimetype: typing.Optional[str]) -> typing.Optional[str]:
+    return _FORMATS_BY_MIMETYPE.get((mimetype or "").lower())
+
+
+def read(stream: typing.BinaryIO, fmt: str) -> typing.List[Record]:
+    """
+    Parse and validate a whole inventory. Rows are numbered from 1 (the CSV
+    header is not a row). Raises ``InventoryError`` if any row is invalid.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="" if fmt == FORMAT_CSV else None)
+    if fmt == FORMAT_JSON:
+        rows = _read_json(text)
+    elif fmt == FORMAT_NDJSON:
+        rows = _read_ndjson(text)
+    elif fmt == FORMAT_CSV:
+        rows = _read_csv(text)
+    else:
+        raise ValueError(f"Unknown inventory format: {fmt}")
+
+    records = []
+    errors = []
+    for number, row in rows:
+        try:
+            records.append(_record(row))
+        except ValueError as e:
+            errors.append({"row": number, "error": str(e)})
+
+    if errors:
+        raise InventoryError(errors)
+    return records
+
+
+def write(devices: typing.Iterable, fmt: str) -> typing.Iterator[str]:
+    """Yield ``devices`` (anything with ip, mac and config) one row at a time."""
+    if fmt == FORMAT_JSON:
+        yield "["
+        for index, device in enumerate(devices):
+            yield ("," if index else "") + json.dumps(_row(device))
+        yield "]\n"
+    elif fmt == FORMAT_NDJSON:
+        for device in devices:
+            yield json.dumps(_row(device)) + "\n"
+    elif fmt == FORMAT_CSV:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_COLUMNS)
+        for device in devices:
+            writer.writerow((device.ip, device.mac, json.dumps(device.config) if device.config else ""))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        raise ValueError(f"Unknown inventory format: {fmt}")
+
+
+def _row(device) -> dict:
+    return {"ip": device.ip, "mac": device.mac, "config": device.config}
+
+
+def _read_json(text: typing.TextIO) -> typing.Iterator[typing.Tuple[int, typing.Any]]:
+    try:
+        data = json.load(text)
+    except ValueError as e:
+        raise InventoryError([{"row": None, "error": f"Invalid JSON: {e}"}])
+
+    # Either a bare array or {"devices": [...]} as returned by device/list
+    if isinstance(data, dict):
+        data = data.get("devices")
+    if not isinstance(data, list):
+        raise InventoryError([{"row": None, "error": "JSON array of devices expected."}])
+
+    return enumerate(data, start=1)
+
+
+def _read_ndjson(text: typing.TextIO) -> typing.Iterator[typing.Tuple[int, typing.Any]]:
+    number = 0
+    for line in text:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            yield number, e
+
+
+def _read_csv(text: typing.TextIO) -> typing.Iterator[typing.Tuple[int, typing.Any]]:
+    reader = csv.DictReader(text)
+    if not reader.fieldnames or not {"ip", "mac"}.issubset(name.strip().lower() for name in reader.fieldnames):
+        raise InventoryError([{"row": None, "error": "CSV header with ip and mac columns expected."}])
+
+    for number, row in enumerate(reader, start=1):
+        # DictReader keeps cells beyond the header as a list under the None key
+        if None in row:
+            yield number, ValueError("Too many columns.")
+            continue
+        row = {(key or "").strip().lower(): (value or "").strip() for key, value in row.items()}
+        config = row.get("config")
+        if config:
+            try:
+                row["config"] = json.loads(config)
+            except ValueError as e:
+                yield number, ValueError(f"Invalid config JSON: {e}")
+                continue
+        else:
+            row.pop("config", None)
+        yield number, row
+
+
+def _record(row: typing.Any) -> Record:
+    if isinstance(row, ValueError):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError("Device object expected.")
+
+    ip = row.get("ip")
+    mac = row.get("mac")
+    config = row.get("config") or {}
+    if not ip or not isinstance(ip, str) or not mac:
+        raise ValueError("Missing required fields: ip and mac.")
+    if not isinstance(config, dict):
+        raise ValueError("Invalid field: config must be an object.")
+    server.serverlib.endpoint.from_config(ip, config)
+
+    return Record(ip, lib.magic_packet.mac_to_int(mac), config)
@@ -0,0 +1,218 @@
+"""migrations.py: Versioned schema migrations for devices.db"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import time
+import typing
+import sqlite3
+import logging
+
+import lib.magic_packet
+
+logger = logging.getLogger(__name__)
+
+
+class Migration(typing.NamedTuple):
+    version: int
+    description: str
+    apply: typing.Callable[[sqlite3.Connection], None]
+
+
+def _statements(*statements: str) -> typing.Callable[[sqlite3.Connection], None]:
+    def apply(connection: sqlite3.Connection) -> None:
+        for statement in statements:
+            connection.execute(statement)
+    return apply
+
+
+# Bumps the devices generation on every change, so every process can tell
+# whether its in-memory copy is still current
+_GENERATION_TRIGGERS = tuple(
+    f"""
+    CREATE TRIGGER IF NOT EXISTS devices_generation_{event.lower()} AFTER {event} ON devices
+    BEGIN
+        UPDATE counters SET value = value + 1 WHERE name = 'devices';
+    END
+    """
+    for event in ("INSERT", "UPDATE", "DELETE")
+)
+
+
+def _devices_by_integer_mac(connection: sqlite3.Connection) -> None:
+    columns = {row[1]: row[2].upper() for row in connection.execute("PRAGMA table_info(devices)")}
+    if columns.get("mac") == "TEXT":
+        rows = connection.execute("SELECT id, ip, mac, config FROM devices ORDER BY id").fetchall()
+        sequence = connection.execute("SELECT seq FROM sqlite_sequence WHERE name = 'devices'").fetchone()
+
+        # Duplicates of the same MAC collapse into the most recently configured
+        # one. Rows that cannot be kept are set aside, never deleted
+        devices = {}
+        rejected = []
+        for row in rows:
+            try:
+                key = lib.magic_packet.mac_to_int(row[2])
+            except ValueError:
+                rejected.append((*row, "invalid MAC address"))
+                continue
+            previous = devices.pop(key, None)
+            if previous is not None:
+                rejected.append((*previous, f"same MAC as device {row[0]}"))
+            devices[key] = row
+
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS devices_rejected (
+                id INTEGER NOT NULL,
+                ip TEXT,
+                mac TEXT,
+                config TEXT,
+                reason TEXT NOT NULL,
+                rejected_at REAL NOT NULL
+            )
+            """
+        )
+        rejected_at = time.time()
+        connection.executemany(
+            "INSERT INTO devices_rejected (id, ip, mac, config, reason, rejected_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(*row, rejected_at) for row in rejected]
+        )
+        for device_id, _, mac, _, reason in rejected:
+            logger.warning(f"device {device_id} ({mac!r}) moved to devices_rejected: {reason}")
+
+        # Triggers go away together with the table and are recreated below
+        connection.execute("DROP TABLE devices")
+        connection.execute(
+            """
+            CREATE TABLE devices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ip TEXT NOT NULL,
+                mac INTEGER NOT NULL,
+                config TEXT
+            )
+            """
+        )
+        connection.executemany(
+            "INSERT INTO devices (id, ip, mac, config) VALUES (?, ?, ?, ?)",
+            [(device_id, ip, key, config) for key, (device_id, ip, _, config) in devices.items()]
+        )
+        # Ids are handles for wake/batch and bulk: a set aside id must never
+        # be handed to a new device
+        last_id = max([sequence[0] if sequence else 0] + [row[0] for row in rows])
+        connection.execute("DELETE FROM sqlite_sequence WHERE name = 'devices'")
+        if last_id:
+            connection.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('devices', ?)", (last_id,))
+        # Rows changed without the triggers, let other processes reload
+        connection.execute("UPDATE counters SET value = value + 1 WHERE name = 'devices'")
+        logger.info(f"devices table rebuilt, {len(rows)} rows in, {len(devices)} rows kept")
+
+    connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS devices_mac ON devices (mac)")
+    connection.execute("CREATE INDEX IF NOT EXISTS devices_ip ON devices (ip)")
+    _statements(*_GENERATION_TRIGGERS)(connection)
+
+
+# Append only. Databases created before versioning start at 0 and replay
+# everything, so every step must accept a schema it already partly finds.
+MIGRATIONS = (
+    Migration(1, "devices and settings tables", _statements(
+        """
+        CREATE TABLE IF NOT EXISTS devices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip TEXT NOT NULL,
+            mac TEXT NOT NULL,
+            config TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        """,
+    )),
+    Migration(2, "devices generation counter", _statements(
+        """
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """,
+        "INSERT OR IGNORE INTO counters (name, value) VALUES ('devices', 0)",
+        *_GENERATION_TRIGGERS,
+    )),
+    Migration(3, "devices keyed by integer MAC", _devices_by_integer_mac),
+    Migration(4, "heartbeats and health resets shared by worker processes", _statements(
+        """
+        CREATE TABLE IF NOT EXISTS heartbeats (
+            address TEXT PRIMARY KEY,
+            seen_at REAL NOT NULL,
+            interval REAL NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS health_resets (
+            address TEXT PRIMARY KEY,
+            reset_at REAL NOT NULL
+        )
+        """,
+    )),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(connection: sqlite3.Connection) -> int:
+    try:
+        row = connection.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        # No schema_version table yet
+        return 0
+    return row[0] or 0
+
+
+def migrate(connection: sqlite3.Connection) -> int:
+    """
+    Apply every pending migration, each in its own transaction, and return
+    the resulting schema version.
+
+    Safe to run from several processes at once: the version is re-read under
+    the write lock before each step.
+    """
+    with connection:
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at REAL NOT NULL
+            )
+            """
+        )
+
+    version = current_version(connection)
+    if version > LATEST_VERSION:
+        logger.warning(f"database schema {version} is newer than this build ({LATEST_VERSION})")
+        return version
+
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+
+        with connection:
+            # DDL included, a failed step leaves the previous version intact
+            connection.execute("BEGIN IMMEDIATE")
+            # Another process may have applied it while we waited for the lock
+            pending = current_version(connection) < migration.version
+            if pending:
+                migration.apply(connection)
+                connection.execute(
+                    "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                    (migration.version, migration.description, time.time())
+                )
+        version = migration.version
+        if pending:
+            logger.info(f"database schema migrated to {version}: {migration.description}")
+
+    return version
@@ -0,0 +1,328 @@
+"""monitor.py: Background refresh of children status"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import os
+import json
+import time
+import queue
+import typing
+import logging
+import pathlib
+import threading
+
+logger = logging.getLogger(__name__)
+
+# How often a worker that does not probe looks for a newer shared snapshot
+_FOLLOW_INTERVAL = 1.0
+
+
+class ProbeRound:
+    """Results of one probe round, readable while the round is still running."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._results: typing.Dict[str, dict] = {}
+        self._arrivals: typing.List[dict] = []
+        self._done = threading.Event()
+        self.snapshot: typing.Optional[dict] = None
+        self.error: typing.Optional[Exception] = None
+
+    def add(self, child: dict) -> None:
+        child.setdefault("checked_at", time.time())
+        with self._changed:
+            self._results[child["ip"]] = child
+            self._arrivals.append(child)
+            self._changed.notify_all()
+
+    def results(self) -> typing.Dict[str, dict]:
+        with self._lock:
+            return dict(self._results)
+
+    def follow(self, timeout: typing.Optional[float] = None) -> typing.Iterator[dict]:
+        """Yield results in arrival order until the round is done or ``timeout`` expires."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        sent = 0
+        while True:
+            with self._changed:
+                while len(self._arrivals) == sent and not self._done.is_set():
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return
+                    self._changed.wait(remaining)
+                batch = self._arrivals[sent:]
+                sent += len(batch)
+                finished = self._done.is_set() and sent == len(self._arrivals)
+
+            yield from batch
+            if finished:
+                return
+
+    def finish(self, snapshot: typing.Optional[dict] = None, error: typing.Optional[Exception] = None) -> None:
+        with self._changed:
+            self.snapshot = snapshot
+            self.error = error
+            self._done.set()
+            self._changed.notify_all()
+
+    def wait(self, timeout: typing.Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @classmethod
+    def completed(cls, snapshot: dict) -> 'ProbeRound':
+        probe_round = cls()
+        for child in snapshot["children"]:
+            probe_round.add(child)
+        probe_round.finish(snapshot)
+        return probe_round
+
+
+class SharedStatus:
+    """
+    Status shared by the worker processes of one server.
+
+    Only the process holding ``status.lock`` in ``directory`` probes; it
+    writes every snapshot to ``status.json`` next to it and the others read
+    it from there. The lock is released when its holder exits, and the next
+    worker to ask takes over. In client mode the same lock picks the worker
+    that sends heartbeats.
+    """
+
+    def __init__(self, directory: pathlib.Path):
+        self.lock_path = directory / "status.lock"
+        self.snapshot_path = directory / "status.json"
+        self._lock_file: typing.Optional[typing.TextIO] = None
+        self._read_mtime: typing.Optional[int] = None
+        self._read_snapshot: typing.Optional[dict] = None
+
+    @property
+    def leading(self) -> bool:
+        return self._lock_file is not None
+
+    def lead(self) -> bool:
+        """True if this process holds the lock, taking it when it is free."""
+        if self._lock_file is not None:
+            return True
+        try:
+            import fcntl
+        except ImportError:
+            # No fork on this platform either, so there is a single process
+            return True
+
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info(f"process {os.getpid()} runs the status monitor of all workers")
+        return True
+
+    def write(self, snapshot: dict) -> None:
+        # Readers never see a half written file
+        temporary = self.snapshot_path.with_name(f"{self.snapshot_path.name}.{os.getpid()}.tmp")
+        temporary.write_text(json.dumps(snapshot), encoding="utf-8")
+        os.replace(temporary, self.snapshot_path)
+
+    def read(self) -> typing.Optional[dict]:
+        """Last snapshot written by the leader, parsed again only when the file changed."""
+        try:
+            mtime = self.snapshot_path.stat().st_mtime_ns
+            if mtime != self._read_mtime:
+                self._read_snapshot = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+                self._read_mtime = mtime
+        except (OSError, ValueError) as e:
+            logger.debug(f"cannot read shared status: {e}")
+        return self._read_snapshot
+
+
+class StatusMonitor:
+    """
+    Periodically runs ``probe`` on a daemon thread and keeps the last result.
+
+    ``probe`` takes a per-result callback and returns a list of
+    ``{"ip": ..., "status": ...}`` dicts. Every child in the snapshot gets a
+    ``checked_at`` timestamp so callers can tell how old the answer is.
+
+    Rounds are single-flight: callers arriving while a round is running join
+    it, and a round finished less than ``reuse_window`` seconds ago is
+    handed out again instead of probing the children twice.
+
+    With ``shared`` set, only one process probes (see ``SharedStatus``) and
+    the monitors of the other processes follow its snapshots.
+
+    Subscribers get a ``("change", child)`` event on their queue whenever a
+    child goes up or down between two rounds, however many of them are
+    listening. A subscriber whose queue fills up loses its pending events
+    and gets a single ``("snapshot", snapshot)`` event to start over from.
+    """
+
+    def __init__(self, probe: typing.Callable[[typing.Callable[[dict], None]], typing.List[dict]],
+                 interval: float = 10.0, reuse_window: float = 1.0, shared: typing.Optional[SharedStatus] = None):
+        self.probe = probe
+        self.interval = interval
+        self.reuse_window = reuse_window
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._snapshot: typing.Optional[dict] = None
+        self._version = 0
+        self._current: typing.Optional[ProbeRound] = None
+        self._subscribers: typing.List[queue.Queue] = []
+        self._publish_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: typing.Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="status-monitor", daemon=True)
+        self._thread.start()
+        logger.info(f"status monitor started, interval {self.interval}s")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def refresh(self) -> dict:
+        probe_round = self.start_round()
+        probe_round.wait()
+        if probe_round.error is not None:
+            raise probe_round.error
+        return probe_round.snapshot
+
+    def start_round(self) -> ProbeRound:
+        """Join or start a probe round on its own thread, callers may stop waiting for it early."""
+        with self._lock:
+            if self._current is not None and not self._current.done():
+                return self._current
+
+            snapshot = self._snapshot
+            if snapshot is not None and time.time() - snapshot["updated_at"] < self.reuse_window:
+                return ProbeRound.completed(snapshot)
+
+            probe_round = ProbeRound()
+            self._current = probe_round
+
+        thread = threading.Thread(target=self._run_round, args=(probe_round,), name="status-round", daemon=True)
+        thread.start()
+        return probe_round
+
+    def snapshot(self) -> typing.Optional[dict]:
+        with self._lock:
+            return self._snapshot
+
+    def subscribe(self, maxsize: int = 1024) -> queue.Queue:
+        events = queue.Queue(maxsize=maxsize)
+        with self._lock:
+            self._subscribers.append(events)
+        return events
+
+    def unsubscribe(self, events: queue.Queue) -> None:
+        with self._lock:
+            if events in self._subscribers:
+                self._subscribers.remove(events)
+
+    def _run_round(self, probe_round: ProbeRound) -> None:
+        try:
+            children = self.probe(probe_round.add)
+        except Exception as e:
+            probe_round.finish(error=e)
+            return
+
+        checked_at = time.time()
+        for child in children:
+            child.setdefault("checked_at", checked_at)
+
+        with self._lock:
+            # Tells snapshots apart cheaply, e.g. for ETags
+            self._version += 1
+            snapshot = {"updated_at": checked_at, "children": children, "version": self._version}
+            previous = self._snapshot
+            self._snapshot = snapshot
+            subscribers = list(self._subscribers)
+        probe_round.finish(snapshot)
+
+        if self.shared is not None and self.shared.leading:
+            try:
+                self.shared.write(snapshot)
+            except OSError as e:
+                logger.error(f"cannot share children status: {e}")
+
+        if subscribers:
+            self._publish(subscribers, snapshot, _changes(previous, snapshot))
+
+    def _follow(self) -> None:
+        snapshot = self.shared.read()
+        with self._lock:
+            previous = self._snapshot
+            if snapshot is None or (previous is not None and snapshot["updated_at"] <= previous["updated_at"]):
+                return
+            self._version = max(self._version, snapshot["version"])
+            self._snapshot = snapshot
+            subscribers = list(self._subscribers)
+
+        if subscribers:
+            self._publish(subscribers, snapshot, _changes(previous, snapshot))
+
+    def _publish(self, subscribers: typing.List[queue.Queue], snapshot: dict, changes: typing.List[dict]) -> None:
+        with self._publish_lock:
+            for events in subscribers:
+                for change in changes:
+                    try:
+                        events.put_nowait(("change", change))
+                    except queue.Full:
+                        _resync(events, snapshot)
+                        break
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self.shared is not None and not self.shared.lead():
+                self._follow()
+                self._stop.wait(min(self.interval, _FOLLOW_INTERVAL))
+                continue
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"cannot refresh children status: {e}")
+            self._stop.wait(self.interval)
+
+
+def _resync(events: queue.Queue, snapshot: dict) -> None:
+    # Slow listener: its pending changes are useless once some are lost, the
+    # snapshot already includes all of them
+    while True:
+        try:
+            events.get_nowait()
+        except queue.Empty:
+            break
+    events.put_nowait(("snapshot", snapshot))
+
+
+def _changes(previous: typing.Optional[dict], current: dict) -> typing.List[dict]:
+    """Children whose up/down state differs between two snapshots."""
+    before = {child["ip"]: child["status"] for child in previous["children"]} if previous else {}
+    changes = []
+    for child in current["children"]:
+        if before.get(child["ip"]) != child["status"]:
+            changes.append({
+                "ip": child["ip"],
+                "status": child["status"],
+                "previous": before.get(child["ip"]),
+                "checked_at": child["checked_at"],
+            })
+    return changes
@@ -0,0 +1,136 @@
+"""neighbors.py: Device presence from the kernel neighbor table (Linux)"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import time
+import typing
+import logging
+import pathlib
+import threading
+import subprocess
+
+import lib.magic_packet
+
+logger = logging.getLogger(__name__)
+
+ARP_PATH = pathlib.Path("/proc/net/arp")
+
+REACHABLE = "REACHABLE"
+STALE = "STALE"
+FAILED = "FAILED"
+
+# States in which the kernel has recently heard from the neighbor
+UP_STATES = frozenset((REACHABLE, "DELAY", "PROBE", "PERMANENT"))
+
+_ATF_COM = 0x2  # completed entry, from include/uapi/linux/if_arp.h
+
+
+def parse_proc_arp(text: str) -> typing.Dict[str, str]:
+    """
+    Map normalized MAC and IP to state from ``/proc/net/arp`` contents.
+
+    The proc file only knows complete and incomplete entries, so they are
+    reported as ``REACHABLE`` and ``FAILED``. Incomplete entries have no
+    MAC and are found by IP only.
+    """
+    states = {}
+    for line in text.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+        try:
+            mac = lib.magic_packet.normalize_mac(fields[3])
+            flags = int(fields[2], 16)
+        except ValueError:
+            continue
+        state = REACHABLE if flags & _ATF_COM else FAILED
+        _keep(states, fields[0], state)
+        if mac != "000000000000":
+            _keep(states, mac, state)
+    return states
+
+
+def parse_ip_neigh(text: str) -> typing.Dict[str, str]:
+    """
+    Map normalized MAC and IP to state from ``ip neigh show`` output.
+
+    The kernel prints ``lladdr`` only for resolved entries, so ``FAILED``
+    and ``INCOMPLETE`` ones are found by IP only.
+    """
+    states = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 2:
+            continue
+        state = fields[-1].upper()
+        _keep(states, fields[0], state)
+        if "lladdr" not in fields:
+            continue
+        try:
+            mac = lib.magic_packet.normalize_mac(fields[fields.index("lladdr") + 1])
+        except (IndexError, ValueError):
+            continue
+        _keep(states, mac, state)
+    return states
+
+
+def _keep(states: typing.Dict[str, str], key: str, state: str) -> None:
+    # Same MAC or IP may show up on several interfaces, keep the most alive entry
+    if states.get(key) not in UP_STATES:
+        states[key] = state
+
+
+class NeighborTable:
+    """
+    Cached view of the neighbor table, read at most once per ``ttl`` seconds.
+
+    Prefers ``ip neigh`` (which knows ``STALE``) and falls back to
+    ``/proc/net/arp``. On systems without either the table is empty.
+    Entries are indexed by normalized MAC and by IP, which cannot collide.
+    """
+
+    def __init__(self, arp_path: pathlib.Path = ARP_PATH, use_ip_command: bool = True, ttl: float = 1.0):
+        self.arp_path = arp_path
+        self.use_ip_command = use_ip_command
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._states: typing.Dict[str, str] = {}
+        self._read_at = 0.0
+
+    def state(self, mac: str, ip: typing.Optional[str] = None) -> typing.Optional[str]:
+        """State of the entry with this MAC, else of the entry with this IP."""
+        states = self.states()
+        try:
+            state = states.get(lib.magic_packet.normalize_mac(mac))
+        except ValueError:
+            state = None
+        if state is None and ip:
+            state = states.get(ip)
+        return state
+
+    def states(self) -> typing.Dict[str, str]:
+        with self._lock:
+            if time.monotonic() - self._read_at >= self.ttl:
+                self._states = self._read()
+                self._read_at = time.monotonic()
+            return self._states
+
+    def _read(self) -> typing.Dict[str, str]:
+        if self.use_ip_command:
+            try:
+                output = subprocess.run(
+                    ["ip", "neigh", "show"], capture_output=True, text=True, timeout=1.0, check=True
+                ).stdout
+                return parse_ip_neigh(output)
+            except (OSError, subprocess.SubprocessError):
+                # No iproute2, use the proc file from now on
+                self.use_ip_command = False
+
+        try:
+            return parse_proc_arp(self.arp_path.read_text())
+        except OSError as e:
+            logger.debug(f"cannot read neighbor table: {e}")
+            return {}
@@ -0,0 +1,257 @@
+"""probe.py: Backends for checking children liveness"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import abc
+import ssl
+import time
+import socket
+import typing
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import requests.adapters
+
+import server.serverlib.endpoint
+
+STATUS_PATH = "/info/status"
+CONNECT_TIMEOUT = 0.5
+READ_TIMEOUT = 0.8
+
+# How a child is checked: bare TCP connect, HTTP HEAD or full HTTP GET of STATUS_PATH
+STRATEGY_TCP = "tcp"
+STRATEGY_HEAD = "head"
+STRATEGY_GET = "get"
+STRATEGIES = (STRATEGY_TCP, STRATEGY_HEAD, STRATEGY_GET)
+
+Timeouts = typing.Callable[[str], typing.Tuple[float, float]]
+Strategies = typing.Callable[[str], str]
+Endpoints = typing.Callable[[str], server.serverlib.endpoint.Endpoint]
+OnResult = typing.Callable[[dict], None]
+
+
+def _default_timeouts(ip: str) -> typing.Tuple[float, float]:
+    return CONNECT_TIMEOUT, READ_TIMEOUT
+
+
+def _default_strategy(ip: str) -> str:
+    return STRATEGY_GET
+
+
+class Probe(abc.ABC):
+    def __init__(self, timeouts: typing.Optional[Timeouts] = None, strategies: typing.Optional[Strategies] = None,
+                 endpoints: typing.Optional[Endpoints] = None):
+        # Return (connect, read) timeouts, the probe strategy and the endpoint for a given child
+        self.timeouts = timeouts or _default_timeouts
+        self.strategies = strategies or _default_strategy
+        self.endpoints = endpoints or server.serverlib.endpoint.parse
+
+    @abc.abstractmethod
+    def probe(self, ips: typing.List[str], on_result: typing.Optional[OnResult] = None) -> typing.List[dict]:
+        """
+        Return ``{"ip": ..., "status": bool, "rtt_ms": float}`` for every ip.
+
+        Failed probes that ran out of time also carry ``"timed_out": True``.
+        ``on_result`` is called with each result as soon as it is known, from
+        whatever thread finished the probe.
+        """
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class ThreadProbe(Probe):
+    """Blocking probes on a persistent thread pool and ``requests`` session."""
+
+    def __init__(self, timeouts: typing.Optional[Timeouts] = None, strategies: typing.Optional[Strategies] = None,
+                 max_workers: int = 32, endpoints: typing.Optional[Endpoints] = None):
+        super().__init__(timeouts, strategies, endpoints)
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._session: typing.Optional[requests.Session] = None
+        self._executor: typing.Optional[ThreadPoolExecutor] = None
+
+    def probe(self, ips: typing.List[str], on_result: typing.Optional[OnResult] = None) -> typing.List[dict]:
+        session, executor = self._resources()
+        futures = [executor.submit(self._check_child, session, ip, on_result) for ip in ips]
+        return [future.result() for future in futures]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _resources(self) -> typing.Tuple[requests.Session, ThreadPoolExecutor]:
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=self.max_workers, pool_maxsize=self.max_workers, max_retries=0
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="probe"
+                )
+            return self._session, self._executor
+
+    def _check_child(self, session: requests.Session, ip: str, on_result: typing.Optional[OnResult]) -> dict:
+        strategy = self.strategies(ip)
+        timeouts = self.timeouts(ip)
+        endpoint = self.endpoints(ip)
+        timed_out = False
+        started = time.monotonic()
+        try:
+            if strategy == STRATEGY_TCP:
+                with socket.create_connection((endpoint.host, endpoint.port), timeout=timeouts[0]):
+                    ok = True
+            else:
+                url = endpoint.url(STATUS_PATH)
+                method = session.head if strategy == STRATEGY_HEAD else session.get
+                ok = method(url, timeout=timeouts).status_code == 200
+        except (requests.Timeout, socket.timeout):
+            ok, timed_out = False, True
+        except (requests.RequestException, OSError):
+            ok = False
+        return _result(ip, ok, time.monotonic() - started, timed_out, on_result)
+
+
+class AsyncProbe(Probe):
+    """
+    Minimal TCP/HTTP/1.1 probes over asyncio streams, all on one thread.
+
+    The event loop lives on its own daemon thread for the life of the probe,
+    callers from any thread submit a round to it and wait for the result.
+    Only the status line is read, so a probe costs one connection and a few
+    hundred bytes. ``max_in_flight`` bounds open sockets, keep it below the
+    process file descriptor limit.
+    """
+
+    def __init__(self, timeouts: typing.Optional[Timeouts] = None, strategies: typing.Optional[Strategies] = None,
+                 max_in_flight: int = 1024, endpoints: typing.Optional[Endpoints] = None):
+        super().__init__(timeouts, strategies, endpoints)
+        self.max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._thread: typing.Optional[threading.Thread] = None
+
+    def probe(self, ips: typing.List[str], on_result: typing.Optional[OnResult] = None) -> typing.List[dict]:
+        if not ips:
+            return []
+        future = asyncio.run_coroutine_threadsafe(self._probe_all(ips, on_result), self._get_loop())
+        return future.result()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=1.0)
+            self._loop = None
+            self._thread = None
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="async-probe", daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    async def _probe_all(self, ips: typing.List[str], on_result: typing.Optional[OnResult]) -> typing.List[dict]:
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        return list(await asyncio.gather(*(self._check_child(semaphore, ip, on_result) for ip in ips)))
+
+    async def _check_child(self, semaphore: asyncio.Semaphore, ip: str, on_result: typing.Optional[OnResult]) -> dict:
+        async with semaphore:
+            timed_out = False
+            started = time.monotonic()
+            try:
+                ok = await self._get_status(self.endpoints(ip), STATUS_PATH, self.timeouts(ip), self.strategies(ip))
+            except asyncio.TimeoutError:
+                ok, timed_out = False, True
+            return _result(ip, ok, time.monotonic() - started, timed_out, on_result)
+
+    @staticmethod
+    async def _get_status(endpoint: server.serverlib.endpoint.Endpoint, path: str,
+                          timeouts: typing.Tuple[float, float], strategy: str) -> bool:
+        host, port = endpoint.host, endpoint.port
+        path = endpoint.base_path + path
+        connect_timeout, read_timeout = timeouts
+        writer = None
+        try:
+            # A TLS child counts as up only once the handshake succeeded
+            tls = _ssl_context() if endpoint.scheme == "https" else None
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=tls), timeout=connect_timeout
+            )
+            if strategy == STRATEGY_TCP:
+                return True
+
+            method = "HEAD" if strategy == STRATEGY_HEAD else "GET"
+            writer.write(
+                f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode()
+            )
+            await writer.drain()
+            status_line = await asyncio.wait_for(reader.readline(), timeout=read_timeout)
+            parts = status_line.split(None, 2)
+            return len(parts) >= 2 and parts[0].startswith(b"HTTP/") and parts[1] == b"200"
+        except asyncio.TimeoutError:
+            # An OSError since Python 3.11, _check_child reports it as a timeout
+            raise
+        except OSError:
+            return False
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+_tls_context: typing.Optional[ssl.SSLContext] = None
+
+
+def _ssl_context() -> ssl.SSLContext:
+    global _tls_context
+    if _tls_context is None:
+        _tls_context = ssl.create_default_context()
+    return _tls_context
+
+
+def _result(ip: str, ok: bool, elapsed: float, timed_out: bool, on_result: typing.Optional[OnResult]) -> dict:
+    result = {"ip": ip, "status": ok, "rtt_ms": round(elapsed * 1000, 2)}
+    if timed_out:
+        result["timed_out"] = True
+    if on_result is not None:
+        on_result(result)
+    return result
+
+
+_BACKENDS = {
+    "threads": ThreadProbe,
+    "asyncio": AsyncProbe,
+}
+
+
+def get_probe(backend: str = "threads", timeouts: typing.Optional[Timeouts] = None,
+              strategies: typing.Optional[Strategies] = None, concurrency: typing.Optional[int] = None,
+              endpoints: typing.Optional[Endpoints] = None) -> Probe:
+    """``concurrency`` is the thread count or the sockets in flight, depending on the backend."""
+    probe_type = _BACKENDS.get(backend)
+    if probe_type is None:
+        raise ValueError(f"Unknown probe backend: {backend}. Expected one of: {', '.join(_BACKENDS)}")
+    if concurrency is None:
+        return probe_type(timeouts, strategies, endpoints=endpoints)
+    return probe_type(timeouts, strategies, max(concurrency, 1), endpoints=endpoints)
@@ -0,0 +1,258 @@
+"""registry.py: In-memory index of configured devices"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import json
+import time
+import bisect
+import typing
+import logging
+import threading
+
+import lib.magic_packet
+import server.serverlib.database
+import server.serverlib.endpoint
+import server.serverlib.settings
+
+logger = logging.getLogger(__name__)
+
+
+class Device(typing.NamedTuple):
+    id: int
+    ip: str
+    mac: str
+    config: dict
+
+    @property
+    def endpoint(self) -> server.serverlib.endpoint.Endpoint:
+        try:
+            return server.serverlib.endpoint.from_config(self.ip, self.config)
+        except ValueError:
+            # Stored before endpoints were validated, fall back to the defaults
+            return server.serverlib.endpoint.Endpoint(self.ip, server.serverlib.endpoint.default_port())
+
+    @property
+    def address(self) -> str:
+        return self.endpoint.address
+
+
+class DeviceRegistry:
+    """
+    All rows of ``devices`` kept in memory with indexes by id, MAC, IP and
+    endpoint address.
+
+    Writes made through ``upsert()`` update the indexes in place. Writes from
+    other processes are noticed through the ``devices`` generation counter,
+    which is read at most once per ``check_interval`` seconds; when it moved
+    the whole table is reloaded.
+    """
+
+    def __init__(self, database: server.serverlib.database.Database, check_interval: float = 1.0):
+        self.database = database
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._generation: typing.Optional[int] = None
+        self._checked_at = 0.0
+        self._devices: typing.List[Device] = []
+        self._ids: typing.List[int] = []
+        self._by_id: typing.Dict[int, Device] = {}
+        self._by_mac: typing.Dict[str, typing.List[Device]] = {}
+        self._by_ip: typing.Dict[str, typing.List[Device]] = {}
+        self._by_address: typing.Dict[str, typing.List[Device]] = {}
+
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            self._ensure_fresh()
+            return self._generation or 0
+
+    def load(self) -> None:
+        if not self.database.exists():
+            return
+
+        with self.database.connection() as connection:
+            # Generation first: a concurrent write makes it look older than
+            # the rows, which only costs one extra reload later
+            generation = self._read_generation(connection)
+            rows = connection.execute("SELECT id, ip, mac, config FROM devices ORDER BY id").fetchall()
+
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self._index(Device(row[0], row[1], lib.magic_packet.format_mac(row[2]), _parse_config(row[3])))
+            self._generation = generation
+            self._checked_at = time.monotonic()
+        logger.info(f"device registry loaded, {len(rows)} devices, generation {generation}")
+
+    def all(self) -> typing.List[Device]:
+        with self._lock:
+            self._ensure_fresh()
+            return list(self._devices)
+
+    def page(self, after: int = 0, limit: typing.Optional[int] = None) -> typing.List[Device]:
+        """Devices with ``id > after`` in id order, at most ``limit`` of them."""
+        with self._lock:
+            self._ensure_fresh()
+            start = bisect.bisect_right(self._ids, after)
+            end = None if limit is None else start + limit
+            return self._devices[start:end]
+
+    def by_id(self, device_id: int) -> typing.Optional[Device]:
+        with self._lock:
+            self._ensure_fresh()
+            return self._by_id.get(device_id)
+
+    def by_mac(self, mac: str) -> typing.List[Device]:
+        try:
+            key = lib.magic_packet.normalize_mac(mac)
+        except ValueError:
+            return []
+        with self._lock:
+            self._ensure_fresh()
+            return list(self._by_mac.get(key, ()))
+
+    def by_ip(self, ip: str) -> typing.List[Device]:
+        with self._lock:
+            self._ensure_fresh()
+            return list(self._by_ip.get(ip, ()))
+
+    def by_address(self, address: str) -> typing.List[Device]:
+        with self._lock:
+            self._ensure_fresh()
+            return list(self._by_address.get(address, ()))
+
+    def upsert(self, ip: str, mac: str, config: dict) -> Device:
+        """
+        Store the device with this MAC, replacing its IP and config if it is
+        already known. Raises ``ValueError`` for a malformed MAC.
+        """
+        mac_key = lib.magic_packet.mac_to_int(mac)
+
+        with self._lock:
+            with self.database.connection() as connection:
+                with connection:
+                    connection.execute(
+                        """
+                        INSERT INTO devices (ip, mac, config)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT (mac) DO UPDATE SET ip = excluded.ip, config = excluded.config
+                        """,
+                        (ip, mac_key, json.dumps(config))
+                    )
+                    device_id = connection.execute(
+                        "SELECT id FROM devices WHERE mac = ?", (mac_key,)
+                    ).fetchone()[0]
+                    generation = self._read_generation(connection)
+
+            if self._generation is None or generation != self._generation + 1:
+                # Someone else wrote in between, our indexes are behind anyway
+                self._generation = None
+                self._ensure_fresh()
+                return self._by_id[device_id]
+
+            device = Device(device_id, ip, lib.magic_packet.format_mac(mac_key), config)
+            if device_id in self._by_id:
+                self._replace(device)
+            else:
+                self._index(device)
+            self._generation = generation
+            return device
+
+    def upsert_many(self, devices: typing.Iterable[typing.Tuple[str, int, dict]]) -> int:
+        """
+        Store many ``(ip, mac as integer, config)`` devices in one transaction
+        with upsert semantics, then reload the indexes. Returns the row count.
+        """
+        rows = [(ip, mac, json.dumps(config)) for ip, mac, config in devices]
+
+        with self._lock:
+            with self.database.connection() as connection:
+                with connection:
+                    connection.executemany(
+                        """
+                        INSERT INTO devices (ip, mac, config)
+                        VALUES (?, ?, ?)
+                        ON CONFLICT (mac) DO UPDATE SET ip = excluded.ip, config = excluded.config
+                        """,
+                        rows
+                    )
+            self.load()
+        return len(rows)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation = None
+
+    def _ensure_fresh(self) -> None:
+        if self._generation is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return
+
+        if not self.database.exists():
+            return
+
+        with self.database.connection() as connection:
+            generation = self._read_generation(connection)
+
+        if generation != self._generation:
+            self.load()
+        else:
+            self._checked_at = time.monotonic()
+
+    def _reset(self) -> None:
+        self._devices = []
+        self._ids = []
+        self._by_id = {}
+        self._by_mac = {}
+        self._by_ip = {}
+        self._by_address = {}
+
+    def _index(self, device: Device) -> None:
+        # Ids only grow, so appending keeps both lists sorted
+        self._devices.append(device)
+        self._ids.append(device.id)
+        self._by_id[device.id] = device
+        self._by_ip.setdefault(device.ip, []).append(device)
+        self._by_address.setdefault(device.address, []).append(device)
+        try:
+            self._by_mac.setdefault(lib.magic_packet.normalize_mac(device.mac), []).append(device)
+        except ValueError:
+            logger.warning(f"device {device.id} has an invalid MAC address: {device.mac!r}")
+
+    def _replace(self, device: Device) -> None:
+        devices = [device if known.id == device.id else known for known in self._devices]
+        self._reset()
+        for known in devices:
+            self._index(known)
+
+    @staticmethod
+    def _read_generation(connection) -> int:
+        row = connection.execute("SELECT value FROM counters WHERE name = 'devices'").fetchone()
+        return row[0] if row else 0
+
+
+def _parse_config(config: typing.Optional[str]) -> dict:
+    if not config:
+        return {}
+    try:
+        parsed = json.loads(config)
+    except ValueError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+_registry: typing.Optional[DeviceRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_device_registry() -> DeviceRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = DeviceRegistry(
+                server.serverlib.database.get_database(),
+                check_interval=server.serverlib.settings.get_settings().registry_ttl,
+            )
+        return _registry
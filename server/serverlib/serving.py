@@ -0,0 +1,153 @@
+"""serving.py: WSGI serving backends for the server runner"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import os
+import typing
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import werkzeug.serving
+
+logger = logging.getLogger(__name__)
+
+# Flask's own server, as before
+SERVE_DEVELOPMENT = "development"
+# One process, a bounded pool of request threads
+SERVE_THREADED = "threaded"
+# Pre-forked worker processes with a thread pool each (needs gunicorn)
+SERVE_PREFORK = "prefork"
+SERVE_MODES = (SERVE_DEVELOPMENT, SERVE_THREADED, SERVE_PREFORK)
+
+
+class ServeOptions(typing.NamedTuple):
+    mode: str = SERVE_DEVELOPMENT
+    host: str = "0.0.0.0"
+    port: int = 5154
+    workers: int = os.cpu_count() or 1
+    threads: int = 16
+    backlog: int = 2048
+    keepalive: float = 5.0
+
+
+def serve(app, options: ServeOptions, on_worker_start: typing.Callable[[], None]) -> None:
+    """
+    Serve ``app`` until shutdown.
+
+    ``on_worker_start`` starts the background threads (status monitor,
+    heartbeats). It runs in every process that serves requests, after the
+    fork, because threads do not survive a fork.
+    """
+    if options.mode == SERVE_PREFORK:
+        application = _prefork_application(app, options, on_worker_start)
+        if application is not None:
+            logger.info(f"serving on {options.host}:{options.port} with {options.workers} workers "
+                        f"x {options.threads} threads")
+            application.run()
+            return
+        logger.warning("prefork serving needs os.fork and gunicorn (pip install gunicorn), using threaded")
+
+    if options.mode == SERVE_DEVELOPMENT:
+        on_worker_start()
+        app.run(host=options.host, port=options.port)
+        return
+
+    server = _PooledWSGIServer(options.host, options.port, app, _request_handler(options.keepalive),
+                               threads=options.threads, backlog=options.backlog)
+    # Listening already, so the first status round can reach children on this host
+    on_worker_start()
+    logger.info(f"serving on {options.host}:{options.port} with {options.threads} threads")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def _prefork_application(app, options: ServeOptions, on_worker_start: typing.Callable[[], None]):
+    if not hasattr(os, "fork"):
+        return None
+    try:
+        import gunicorn.app.base
+    except ImportError:
+        return None
+
+    class Application(gunicorn.app.base.BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": f"{options.host}:{options.port}",
+                "workers": options.workers,
+                # gthread parks idle keep-alive connections instead of holding a thread
+                "worker_class": "gthread",
+                "threads": options.threads,
+                "backlog": options.backlog,
+                "keepalive": max(int(options.keepalive), 1),
+                "post_fork": lambda arbiter, worker: on_worker_start(),
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Built before the fork, every worker inherits the same app
+            return app
+
+    return Application()
+
+
+def _request_handler(keepalive: float) -> type:
+    class RequestHandler(werkzeug.serving.WSGIRequestHandler):
+        # Werkzeug closes every connection after its response, so here the
+        # keep-alive setting only bounds how long a silent client holds a thread
+        protocol_version = "HTTP/1.1"
+        timeout = keepalive
+
+    return RequestHandler
+
+
+class _PooledWSGIServer(werkzeug.serving.BaseWSGIServer):
+    """
+    Werkzeug server handing connections to a fixed pool instead of a thread each.
+
+    A connection is accepted only when a pool thread is free, so a burst
+    waits in the kernel listen backlog rather than in an unbounded queue.
+    """
+
+    multithread = True
+
+    def __init__(self, host: str, port: int, app, handler: type, threads: int, backlog: int):
+        # Read by server_activate() inside the base constructor
+        self.request_queue_size = backlog
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="http")
+        self._free_threads = threading.BoundedSemaphore(threads)
+        super().__init__(host, port, app, handler)
+
+    def get_request(self):
+        self._free_threads.acquire()
+        try:
+            return super().get_request()
+        except BaseException:
+            self._free_threads.release()
+            raise
+
+    def process_request(self, request, client_address):
+        try:
+            self._executor.submit(self._process_request, request, client_address)
+        except BaseException:
+            self._free_threads.release()
+            raise
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._free_threads.release()
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,217 @@
+"""settings.py: Startup configuration shared by the runner and both blueprints"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import os
+import typing
+import argparse
+import threading
+import configparser
+
+CONFIG_SECTION = "mpserver"
+
+
+class Settings(typing.NamedTuple):
+    """
+    Every tunable of the server, read once at startup.
+
+    Each field can come from (lowest to highest priority) its default, the
+    ``[mpserver]`` section of the config file, the environment variable
+    ``MP_<FIELD>`` and the command-line flag ``--<field>``.
+    """
+
+    # Serving
+    host: str = "0.0.0.0"
+    port: int = 5154
+    serve: str = "development"
+    workers: int = os.cpu_count() or 1
+    threads: int = 16
+    backlog: int = 2048
+    keepalive: float = 5.0
+
+    # Database; db_path wins over data_dir, both empty means next to the app
+    db_path: str = ""
+    data_dir: str = ""
+    db_pool_size: int = 8
+
+    # Calls to children
+    child_port: int = 5154
+    child_workers: int = 32
+    child_timeout: float = 5.0
+
+    # Status probing
+    probe_backend: str = "threads"
+    probe_strategy: str = "get"
+    probe_threads: int = 32
+    probe_in_flight: int = 1024
+    probe_connect_timeout: float = 0.5
+    probe_read_timeout: float = 0.8
+    probe_timeout_min: float = 0.1
+    probe_timeout_max: float = 2.0
+    status_source: str = "probe"
+    status_interval: float = 10.0
+    status_reuse_window: float = 1.0
+    status_deadline: float = 3.0
+    presence: str = "off"
+    # Open info/status/stream connections per process, 0 is half the threads
+    stream_listeners: int = 0
+
+    # Circuit breaker of unreachable children
+    health_threshold: int = 3
+    health_backoff: float = 5.0
+    health_max_backoff: float = 300.0
+
+    # In-memory caches
+    registry_ttl: float = 1.0
+    neighbor_ttl: float = 1.0
+    magic_packet_cache: int = 4096
+
+    # Client mode heartbeats, off while heartbeat_server is empty
+    heartbeat_server: str = ""
+    heartbeat_api_key: str = ""
+    heartbeat_interval: float = 10.0
+    heartbeat_ip: str = ""
+
+    # Server mode heartbeats: a key accepted besides the API key, and the
+    # longest interval a client may announce
+    heartbeat_key: str = ""
+    heartbeat_max_interval: float = 300.0
+
+
+CHOICES = {
+    "serve": ("development", "threaded", "prefork"),
+    "probe_backend": ("threads", "asyncio"),
+    "probe_strategy": ("get", "head", "tcp"),
+    "status_source": ("probe", "heartbeat"),
+    "presence": ("off", "prefilter", "neighbors"),
+}
+
+# Lower bounds beyond "not negative": zero would spin a loop, block a socket
+# forever or leave no one to do the work
+_POSITIVE = frozenset((
+    "keepalive", "child_timeout", "probe_connect_timeout", "probe_read_timeout", "probe_timeout_min",
+    "probe_timeout_max", "status_interval", "status_deadline", "health_backoff", "health_max_backoff",
+    "registry_ttl", "neighbor_ttl", "heartbeat_interval", "heartbeat_max_interval",
+))
+_AT_LEAST_ONE = frozenset((
+    "workers", "threads", "backlog", "db_pool_size", "child_workers", "probe_threads", "probe_in_flight",
+    "health_threshold",
+))
+# (lower, upper) pairs that must not cross
+_ORDERED = (
+    ("probe_timeout_min", "probe_timeout_max"),
+    ("health_backoff", "health_max_backoff"),
+)
+
+# Older spellings still accepted on the command line
+_FLAG_ALIASES = {
+    "keepalive": ("--keep-alive",),
+}
+
+
+def load(argv: typing.Optional[typing.List[str]] = None,
+         environ: typing.Optional[typing.Mapping[str, str]] = None) -> typing.Tuple[Settings, typing.List[str]]:
+    """
+    Build settings from defaults, config file, environment and ``argv``.
+
+    Returns the settings and the arguments that are not ours, which are left
+    to the platform runner. Raises ``ValueError`` for bad values.
+    """
+    argv = [] if argv is None else argv
+    environ = os.environ if environ is None else environ
+
+    parser = _parser()
+    args, remaining = parser.parse_known_args(argv)
+
+    values = {}
+    config_path = getattr(args, "config", None) or environ.get("MP_CONFIG")
+    if config_path:
+        values.update(_read_config_file(config_path))
+    for name in Settings._fields:
+        env_name = f"MP_{name.upper()}"
+        if env_name in environ:
+            values[name] = environ[env_name]
+    for name in Settings._fields:
+        if hasattr(args, name):
+            values[name] = getattr(args, name)
+
+    settings = Settings(**{name: _convert(name, value) for name, value in values.items()})
+    for lower, upper in _ORDERED:
+        if getattr(settings, lower) > getattr(settings, upper):
+            raise ValueError(f"Invalid value for {lower}: {getattr(settings, lower)!r}, "
+                             f"must not be greater than {upper} ({getattr(settings, upper)!r})")
+    return settings, remaining
+
+
+def _parser() -> argparse.ArgumentParser:
+    # Only flags given explicitly show up in the namespace
+    parser = argparse.ArgumentParser(prog="mpserver", argument_default=argparse.SUPPRESS,
+                                     allow_abbrev=False)
+    parser.add_argument("--config", help="INI file with a [mpserver] section")
+    for name in Settings._fields:
+        flags = (f"--{name.replace('_', '-')}",) + _FLAG_ALIASES.get(name, ())
+        parser.add_argument(*flags, dest=name, metavar=name.upper(), choices=CHOICES.get(name),
+                            help=f"default {Settings._field_defaults[name]!r}, env MP_{name.upper()}")
+    return parser
+
+
+def _read_config_file(path: str) -> typing.Dict[str, str]:
+    parser = configparser.ConfigParser()
+    if not parser.read(path, encoding="utf-8"):
+        raise ValueError(f"Cannot read config file: {path}")
+    if not parser.has_section(CONFIG_SECTION):
+        return {}
+
+    values = {}
+    for key, value in parser.items(CONFIG_SECTION):
+        name = key.replace("-", "_")
+        if name not in Settings._fields:
+            raise ValueError(f"Unknown setting in {path}: {key}")
+        values[name] = value
+    return values
+
+
+def _convert(name: str, value: typing.Any) -> typing.Any:
+    field_type = Settings.__annotations__[name]
+    try:
+        converted = field_type(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid value for {name}: {value!r}, {field_type.__name__} expected")
+
+    choices = CHOICES.get(name)
+    if choices is not None and converted not in choices:
+        raise ValueError(f"Invalid value for {name}: {value!r}, expected one of: {', '.join(choices)}")
+    if field_type in (int, float) and not converted == converted:
+        raise ValueError(f"Invalid value for {name}: {value!r}, number expected")
+    if name in _POSITIVE and converted <= 0:
+        raise ValueError(f"Invalid value for {name}: {value!r}, must be greater than 0")
+    if name in _AT_LEAST_ONE and converted < 1:
+        raise ValueError(f"Invalid value for {name}: {value!r}, must be at least 1")
+    if field_type in (int, float) and converted < 0:
+        raise ValueError(f"Invalid value for {name}: {value!r}, must not be negative")
+    return converted
+
+
+_settings: typing.Optional[Settings] = None
+_settings_lock = threading.Lock()
+
+
+def configure(settings: Settings) -> None:
+    """Install the startup settings; must happen before anything reads them."""
+    global _settings
+    with _settings_lock:
+        if _settings is not None and _settings != settings:
+            raise RuntimeError("settings are already in use, configure() must run first")
+        _settings = settings
+
+
+def get_settings() -> Settings:
+    """Startup settings, or defaults plus config file and environment if none were installed."""
+    global _settings
+    with _settings_lock:
+        if _settings is None:
+            _settings, _ = load()
+        return _settings
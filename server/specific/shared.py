@@ -6,12 +6,18 @@ __copyright__ = "Copyright 2020, Nikita Somenkov"
 __license__ = "GPL"
 
 import abc
+import sys
+import atexit
 import logging
 import typing
 import flask
 
-import server.api.info
-import server.api.control
+import server.serverlib.database
+import server.serverlib.heartbeat
+import server.serverlib.monitor
+import server.serverlib.registry
+import server.serverlib.serving
+import server.serverlib.settings
 import lib.runner
 import lib.factory
 import lib.messages
@@ -22,23 +28,83 @@ class ServerRunner(lib.runner.Runner):
     def __init__(self):
         self.app: typing.Optional[flask.Flask] = None
         self.port = 5154
+        self.settings: typing.Optional[server.serverlib.settings.Settings] = None
         self.logger = logging.getLogger(__name__)
 
     def handle_args(self):
-        pass
+        try:
+            settings, remaining = server.serverlib.settings.load(sys.argv[1:])
+        except ValueError as e:
+            sys.exit(f"mpserver: {e}")
+
+        server.serverlib.settings.configure(settings)
+        # Platform runners look at whatever is left (Windows service commands)
+        sys.argv[1:] = remaining
+        self.port = settings.port
 
     def setup(self):
+        # Imported here, after handle_args() installed the settings they read at import time
+        import server.api.info
+        import server.api.control
+
         logger_options = self.get_specific_logger_options()
         logging.basicConfig(format='[%(asctime)-15s] %(threadName)s: %(message)s', **logger_options)
         logging.getLogger("communication").setLevel(logging.DEBUG)
 
+        self.settings = server.serverlib.settings.get_settings()
+        self.port = self.settings.port
+
         self.app = flask.Flask("mpserver")
         self.app.register_blueprint(server.api.control.control)
         self.app.register_blueprint(server.api.info.info)
         self.app.connectivity = lib.factory.get_connectivity(server_or_client=False)
 
+        # Migrations run once here, request handlers only borrow pooled connections
+        database = server.serverlib.database.get_database()
+        if database.exists():
+            database.initialize()
+            server.serverlib.registry.get_device_registry().load()
+        atexit.register(database.close)
+
     def run(self):
-        self.app.run(host="0.0.0.0", port=self.port)
+        settings = self.settings
+        options = server.serverlib.serving.ServeOptions(
+            mode=settings.serve,
+            host=settings.host,
+            port=settings.port,
+            workers=max(settings.workers, 1),
+            threads=max(settings.threads, 1),
+            backlog=max(settings.backlog, 1),
+            keepalive=settings.keepalive,
+        )
+        # Connections opened above must not be inherited by forked workers
+        server.serverlib.database.get_database().drain()
+        server.serverlib.serving.serve(self.app, options, self.start_background)
+
+    def start_background(self):
+        """Background threads of one serving process, started after any fork."""
+        import server.api.info
+
+        if server.api.info.check_server_status_cached():
+            server.api.info.monitor.start()
+            atexit.register(server.api.info.monitor.stop)
+        elif self.settings.heartbeat_server:
+            # Client mode: push liveness to the server instead of waiting for its probes
+            lead = None
+            if self.settings.serve == "prefork":
+                # Every worker runs a sender, only the one holding the status lock sends
+                directory = server.serverlib.database.get_database().path.parent
+                directory.mkdir(parents=True, exist_ok=True)
+                lead = server.serverlib.monitor.SharedStatus(directory).lead
+            sender = server.serverlib.heartbeat.HeartbeatSender(
+                self.settings.heartbeat_server,
+                api_key=self.settings.heartbeat_api_key,
+                interval=self.settings.heartbeat_interval,
+                ip=self.settings.heartbeat_ip or None,
+                lead=lead,
+            )
+            sender.start()
+            atexit.register(sender.stop)
 
     @abc.abstractmethod
     def get_specific_logger_options(self) -> dict:
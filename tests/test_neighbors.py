@@ -0,0 +1,74 @@
+"""test_neighbors.py: Neighbor table parsers against captured proc and iproute2 output
+
+Run from the repository root with ``python -m unittest discover tests``.
+"""
+
+__author__ = "Nikita Somenkov, Victor Carreon"
+__email__ = "somenkov.nikita@icloud.com, victor.carreon@pm.me"
+__copyright__ = "Copyright 2020–2026, Nikita Somenkov & Victor Carreon"
+__license__ = "GPL"
+
+import pathlib
+import unittest
+
+import lib.magic_packet
+import server.serverlib.neighbors as neighbors
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+
+
+def _mac(mac: str) -> str:
+    return lib.magic_packet.normalize_mac(mac)
+
+
+class ParseProcArpTest(unittest.TestCase):
+    def setUp(self):
+        self.states = neighbors.parse_proc_arp((FIXTURES / "proc_net_arp").read_text())
+
+    def test_complete_entries_are_reachable_by_mac_and_ip(self):
+        self.assertEqual(self.states[_mac("A0B1C2D3E4F5")], neighbors.REACHABLE)
+        self.assertEqual(self.states["192.168.1.1"], neighbors.REACHABLE)
+
+    def test_incomplete_entry_without_mac_is_failed_by_ip(self):
+        self.assertEqual(self.states["192.168.1.5"], neighbors.FAILED)
+        self.assertNotIn(_mac("000000000000"), self.states)
+
+    def test_incomplete_entry_with_stale_mac_is_failed(self):
+        self.assertEqual(self.states[_mac("001122334477")], neighbors.FAILED)
+        self.assertEqual(self.states["192.168.1.7"], neighbors.FAILED)
+
+
+class ParseIpNeighTest(unittest.TestCase):
+    def setUp(self):
+        self.states = neighbors.parse_ip_neigh((FIXTURES / "ip_neigh").read_text())
+
+    def test_unresolved_entries_are_found_by_ip(self):
+        self.assertEqual(self.states["192.168.1.5"], neighbors.FAILED)
+        self.assertEqual(self.states["192.168.1.8"], "INCOMPLETE")
+
+    def test_most_alive_entry_of_a_mac_wins(self):
+        # STALE over IPv4, DELAY over IPv6
+        self.assertEqual(self.states[_mac("001122334455")], "DELAY")
+        self.assertEqual(self.states[_mac("A0B1C2D3E4F5")], neighbors.REACHABLE)
+
+    def test_flags_before_state_are_skipped(self):
+        self.assertEqual(self.states["fe80::1"], neighbors.STALE)
+
+
+class NeighborTableTest(unittest.TestCase):
+    def setUp(self):
+        self.table = neighbors.NeighborTable(arp_path=FIXTURES / "proc_net_arp", use_ip_command=False, ttl=60.0)
+
+    def test_state_by_mac(self):
+        self.assertEqual(self.table.state("00-11-22-33-44-55", "192.168.1.6"), neighbors.REACHABLE)
+
+    def test_state_falls_back_to_ip(self):
+        self.assertEqual(self.table.state("00-11-22-33-44-99", "192.168.1.5"), neighbors.FAILED)
+
+    def test_unknown_device(self):
+        self.assertIsNone(self.table.state("00-11-22-33-44-99", "10.0.0.1"))
+        self.assertIsNone(self.table.state("not a mac"))
+
+
+if __name__ == "__main__":
+    unittest.main()